@@ -0,0 +1,362 @@
+import argparse
+import asyncio
+import contextlib
+import itertools
+import json
+import random
+import subprocess
+import time
+
+import httpx
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+
+from respuestas import a_json
+
+
+def percentil(valores, p):
+    # Percentil por rango más cercano sobre una lista ya ordenada
+    if not valores:
+        return 0.0
+    indice = max(0, min(len(valores) - 1, round(p / 100 * len(valores)) - 1))
+    return valores[indice]
+
+
+class Contexto:
+    # Rangos de ids existentes (p. ej. los de generar_datos.py) y contadores para ids nuevos
+    def __init__(self, args, semilla, nuevos):
+        self.usuarios = args.max_usuario
+        self.citas = args.max_cita
+        self.reparaciones = args.max_reparacion
+        self.refacciones = args.max_refaccion
+        self.aleatorio = random.Random(semilla)
+        # Contador compartido por todos los clientes para ids nuevos (citas, usuarios, refacciones)
+        self.nuevos = nuevos
+
+    def usuario(self):
+        return self.aleatorio.randint(1, self.usuarios)
+
+    def cita(self):
+        return self.aleatorio.randint(1, self.citas)
+
+    def reparacion(self):
+        return self.aleatorio.randint(1, self.reparaciones)
+
+    def refaccion(self):
+        return self.aleatorio.randint(1, self.refacciones)
+
+
+def nueva_cita(ctx):
+    return {
+        "id": next(ctx.nuevos),
+        "motivoCita": "Reparacion de celular",
+        "horaCita": "10:00",
+        "idUsuarioC": ctx.usuario(),
+        "idUsuarioT": ctx.usuario(),
+        "dispositivos": [{
+            "idDispositivo": 1,
+            "marca": "Apple",
+            "modelo": "IPhone 12",
+            "caracteristicasHardware": "128 GB",
+            "fallas": "La pantalla se rompió",
+            "fotosDispositivo": "../foto.img"
+        }]
+    }
+
+
+def nuevo_usuario(ctx):
+    idUsuario = next(ctx.nuevos)
+    return {
+        "idUsuario": idUsuario,
+        "nombre": "Carga",
+        "apellidos": "Benchmark",
+        "email": f"benchmark{idUsuario}@ejemplo.com",
+        "password": "123.Hola",
+        "telefono": "1234567890",
+        "rolUsuario": "Cliente"
+    }
+
+
+def nueva_reparacion(ctx):
+    return {
+        "tipoReparacion": "Cambio de Pantalla",
+        "detalles": "Benchmark",
+        "estatus": "En reparación",
+        "costoServicio": 200,
+        "total": 500,
+        "idCita": ctx.cita(),
+        "idUsuarioC": ctx.usuario(),
+        "idUsuarioT": ctx.usuario(),
+        "idDispositivo": 1,
+        "refacciones": []
+    }
+
+
+# Ruta (plantilla) -> función que arma (método, url, cuerpo) con ids del contexto
+OPERACIONES = {
+    "GET /": lambda ctx: ("GET", "/", None),
+    "POST /citas": lambda ctx: ("POST", "/citas", nueva_cita(ctx)),
+    "POST /citas/bulk": lambda ctx: ("POST", "/citas/bulk", [nueva_cita(ctx) for _ in range(50)]),
+    "GET /citas": lambda ctx: ("GET", f"/citas?after={ctx.cita()}&limit=50", None),
+    "PUT /citas/{idCita}/confirmar": lambda ctx: ("PUT", f"/citas/{ctx.cita()}/confirmar", None),
+    "PUT /citas/{idCita}/cancelar": lambda ctx: ("PUT", f"/citas/{ctx.cita()}/cancelar", None),
+    "PUT /citas/{idCita}/finalizar": lambda ctx: ("PUT", f"/citas/{ctx.cita()}/finalizar", None),
+    "PUT /citas/estatus": lambda ctx: (
+        "PUT", "/citas/estatus", [{"idCita": ctx.cita(), "estatusCita": "Confirmada"} for _ in range(50)]
+    ),
+    "GET /citas/{idCita}": lambda ctx: ("GET", f"/citas/{ctx.cita()}", None),
+    "POST /usuarios": lambda ctx: ("POST", "/usuarios", nuevo_usuario(ctx)),
+    "GET /usuarios": lambda ctx: ("GET", f"/usuarios?after={ctx.usuario()}&limit=50", None),
+    "GET /usuarios/{idUsuario}": lambda ctx: ("GET", f"/usuarios/{ctx.usuario()}", None),
+    "PUT /usuarios/{idUsuario}": lambda ctx: ("PUT", f"/usuarios/{ctx.usuario()}", {
+        "nombre": "Carga", "apellidos": "Benchmark", "telefono": str(ctx.aleatorio.randrange(10 ** 10)),
+        "correoElectronico": f"benchmark{next(ctx.nuevos)}@ejemplo.com", "contraseña": "123.Hola"
+    }),
+    "POST /usuarios/validar": lambda ctx: ("POST", "/usuarios/validar", {
+        "email": f"usuario{ctx.usuario()}@ejemplo.com", "contraseña": "123.Hola"
+    }),
+    "POST /reparaciones": lambda ctx: ("POST", "/reparaciones", nueva_reparacion(ctx)),
+    "GET /reparaciones": lambda ctx: ("GET", f"/reparaciones?after={ctx.reparacion()}&limit=50", None),
+    "GET /reparaciones/{idReparacion}": lambda ctx: ("GET", f"/reparaciones/{ctx.reparacion()}", None),
+    "PUT /reparaciones/{idReparacion}": lambda ctx: (
+        "PUT", f"/reparaciones/{ctx.reparacion()}", {"detalles": "Benchmark"}
+    ),
+    "POST /refacciones": lambda ctx: ("POST", "/refacciones", {
+        "idReparacion": ctx.reparacion(), "idRefaccion": next(ctx.nuevos), "nombre": "Benchmark",
+        "cantidad": 1, "precioUnitario": 100.0, "descripcion": "Benchmark"
+    }),
+    "GET /refacciones": lambda ctx: ("GET", "/refacciones?limit=50", None),
+    "GET /refacciones/{idReparacion}/{idRefaccion}": lambda ctx: (
+        "GET", f"/refacciones/{ctx.reparacion()}/{ctx.refaccion()}", None
+    ),
+    "PUT /refacciones/{idReparacion}/{idRefaccion}": lambda ctx: (
+        "PUT", f"/refacciones/{ctx.reparacion()}/{ctx.refaccion()}",
+        {"nombre": "Benchmark", "cantidad": 1, "precioUnitario": 100.0}
+    ),
+    "GET /monitoreo/cache": lambda ctx: ("GET", "/monitoreo/cache", None),
+    "GET /monitoreo/coalescencia": lambda ctx: ("GET", "/monitoreo/coalescencia", None),
+}
+
+# Mezclas de tráfico: ruta -> peso relativo
+MEZCLAS = {
+    "lectura": {
+        "GET /citas/{idCita}": 40,
+        "GET /usuarios/{idUsuario}": 25,
+        "GET /reparaciones/{idReparacion}": 20,
+        "GET /citas": 10,
+        "GET /refacciones/{idReparacion}/{idRefaccion}": 5,
+    },
+    "mixta": {
+        "GET /citas/{idCita}": 30,
+        "GET /usuarios/{idUsuario}": 15,
+        "GET /reparaciones/{idReparacion}": 15,
+        "GET /citas": 5,
+        "POST /citas": 10,
+        "PUT /citas/{idCita}/confirmar": 5,
+        "PUT /citas/{idCita}/finalizar": 5,
+        "POST /usuarios/validar": 10,
+        "POST /reparaciones": 3,
+        "POST /refacciones": 2,
+    },
+}
+
+
+def operaciones_mongo(conexion):
+    # Operaciones atendidas por mongod según serverStatus (todas las conexiones)
+    contadores = conexion.cliente.admin.command("serverStatus")["opcounters"]
+    return sum(contadores.values())
+
+
+async def cliente(http, ctx, rutas, pesos, peticiones, latencias, errores):
+    # Cada cliente emite sus peticiones en serie, como un usuario real
+    for _ in range(peticiones):
+        metodo, url, cuerpo = OPERACIONES[ctx.aleatorio.choices(rutas, pesos)[0]](ctx)
+        inicio = time.perf_counter()
+        try:
+            respuesta = await http.request(metodo, url, json=cuerpo)
+            if respuesta.status_code >= 500:
+                errores.append(respuesta.status_code)
+        except httpx.HTTPError as error:
+            errores.append(type(error).__name__)
+        latencias.append((time.perf_counter() - inicio) * 1000)
+
+
+async def ejecutar(http, args, nombre, mezcla, conexion):
+    rutas = list(mezcla)
+    pesos = list(mezcla.values())
+    latencias = []
+    errores = []
+    # Ids nuevos por encima de los existentes y distintos en cada corrida
+    nuevos = itertools.count(int(time.time() * 1000) % 10 ** 9 * 1000)
+    contextos = [Contexto(args, args.semilla + i, nuevos) for i in range(args.clientes)]
+
+    operaciones_inicio = operaciones_mongo(conexion) if conexion else None
+    inicio = time.perf_counter()
+    await asyncio.gather(*(
+        cliente(http, ctx, rutas, pesos, args.peticiones, latencias, errores) for ctx in contextos
+    ))
+    duracion = time.perf_counter() - inicio
+
+    latencias.sort()
+    resultado = {
+        "escenario": nombre,
+        "clientes": args.clientes,
+        "peticiones": len(latencias),
+        "errores": len(errores),
+        "rps": round(len(latencias) / duracion, 1),
+        "p50_ms": round(percentil(latencias, 50), 2),
+        "p95_ms": round(percentil(latencias, 95), 2),
+        "p99_ms": round(percentil(latencias, 99), 2),
+    }
+    if conexion:
+        resultado["mongo_ops_por_peticion"] = round(
+            (operaciones_mongo(conexion) - operaciones_inicio) / max(len(latencias), 1), 2
+        )
+    return resultado
+
+
+def escenarios(args):
+    # Una ruta sola, una mezcla, o todas las rutas una por una
+    if args.ruta:
+        return {args.ruta: {args.ruta: 1}}
+    if args.mezcla:
+        return {args.mezcla: MEZCLAS[args.mezcla]}
+    return {ruta: {ruta: 1} for ruta in OPERACIONES}
+
+
+async def suite(args):
+    conexion = None
+    if not args.sin_mongo:
+        from database import ConexionMongoDB
+        conexion = ConexionMongoDB()
+
+    limites = httpx.Limits(max_connections=args.clientes, max_keepalive_connections=args.clientes)
+    if args.en_proceso:
+        # La app corre en este proceso (sin red); el ciclo de vida se ejecuta a mano
+        from main import app, ciclo_de_vida
+        ciclo = ciclo_de_vida(app)
+        http = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://benchmark", limits=limites, timeout=60)
+    else:
+        ciclo = contextlib.nullcontext()
+        http = httpx.AsyncClient(base_url=args.url, limits=limites, timeout=60)
+
+    resultados = []
+    try:
+        async with ciclo, http:
+            for nombre, mezcla in escenarios(args).items():
+                resultados.append(await ejecutar(http, args, nombre, mezcla, conexion))
+                print(json.dumps(resultados[-1], ensure_ascii=False))
+    finally:
+        if conexion:
+            conexion.cerrar()
+    return resultados
+
+
+def commit_actual():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+
+def comparar(actual, ruta_base, tolerancia):
+    # Compara contra un resultado anterior y marca regresiones de p99 o RPS mayores a la tolerancia
+    with open(ruta_base, encoding="utf-8") as archivo:
+        base = {r["escenario"]: r for r in json.load(archivo)["resultados"]}
+
+    regresiones = 0
+    for resultado in actual:
+        anterior = base.get(resultado["escenario"])
+        if anterior is None:
+            continue
+        cambio_p99 = (resultado["p99_ms"] - anterior["p99_ms"]) / max(anterior["p99_ms"], 1e-9)
+        cambio_rps = (resultado["rps"] - anterior["rps"]) / max(anterior["rps"], 1e-9)
+        regresion = cambio_p99 > tolerancia or cambio_rps < -tolerancia
+        regresiones += regresion
+        print(f"{'REGRESIÓN' if regresion else 'ok':10} {resultado['escenario']}: "
+              f"p99 {anterior['p99_ms']} -> {resultado['p99_ms']} ms ({cambio_p99:+.0%}), "
+              f"rps {anterior['rps']} -> {resultado['rps']} ({cambio_rps:+.0%})")
+    return regresiones
+
+
+def cita_sintetica(idCita):
+    return {
+        "_id": ObjectId(),
+        "idCita": idCita,
+        "fechaRegistro": "01/04/2024",
+        "fechaRegistroISO": "2024-04-01",
+        "fechaEntrega": "04/04/2024",
+        "motivoCita": "Reparacion de celular",
+        "horaCita": "16:00",
+        "estatusCita": "Pendiente",
+        "idUsuarioC": 3,
+        "idUsuarioT": 2,
+        "dispositivos": [{
+            "idDispositivo": 1,
+            "marca": "Apple",
+            "modelo": "IPhone 12",
+            "caracteristicasHardware": "XXXX",
+            "fallas": "La pantalla se rompió y no deja hacer nada",
+            "fotosDispositivo": "../fotoDispositivo1.img"
+        }]
+    }
+
+
+def serializacion(citas, repeticiones):
+    # Micro-benchmark del cuerpo de GET /citas: ruta anterior (str(_id) + jsonable_encoder + json) contra orjson
+    def anterior():
+        for cita in citas:
+            cita["_id"] = str(cita["_id"])
+        return json.dumps(jsonable_encoder({"citas": citas}), ensure_ascii=False).encode()
+
+    def nueva():
+        return a_json({"citas": citas})
+
+    resultado = {"citas": len(citas)}
+    for nombre, funcion in (("orjson_ms", nueva), ("jsonable_encoder_ms", anterior)):
+        inicio = time.perf_counter()
+        for _ in range(repeticiones):
+            funcion()
+        resultado[nombre] = round((time.perf_counter() - inicio) * 1000 / repeticiones, 3)
+    return resultado
+
+
+def main():
+    # Uso: uvicorn main:app y después python benchmark.py --mezcla mixta --clientes 200 --resultados bench.json
+    parser = argparse.ArgumentParser(description="Suite de benchmarks de la API")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--en-proceso", action="store_true",
+                        help="Ejecutar la app en este proceso con httpx.ASGITransport en lugar de --url")
+    parser.add_argument("--ruta", choices=list(OPERACIONES), help="Medir solo esta ruta")
+    parser.add_argument("--mezcla", choices=list(MEZCLAS), help="Medir una mezcla de rutas")
+    parser.add_argument("--clientes", type=int, default=200)
+    parser.add_argument("--peticiones", type=int, default=50, help="Peticiones por cliente")
+    parser.add_argument("--semilla", type=int, default=575)
+    parser.add_argument("--max-usuario", type=int, default=6)
+    parser.add_argument("--max-cita", type=int, default=4)
+    parser.add_argument("--max-reparacion", type=int, default=3)
+    parser.add_argument("--max-refaccion", type=int, default=2)
+    parser.add_argument("--sin-mongo", action="store_true", help="No medir operaciones de MongoDB por petición")
+    parser.add_argument("--resultados", help="Archivo JSON donde guardar los resultados")
+    parser.add_argument("--comparar", help="Archivo JSON de una corrida anterior para detectar regresiones")
+    parser.add_argument("--tolerancia", type=float, default=0.10)
+    parser.add_argument("--serializacion", type=int, metavar="CITAS",
+                        help="Solo medir la serialización de una página de CITAS citas, sin servidor")
+    args = parser.parse_args()
+
+    if args.serializacion:
+        resultado = serializacion([cita_sintetica(i) for i in range(args.serializacion)], repeticiones=20)
+        for campo, valor in resultado.items():
+            print(f"{campo}: {valor}")
+        return
+
+    resultados = asyncio.run(suite(args))
+    if args.resultados:
+        with open(args.resultados, "w", encoding="utf-8") as archivo:
+            json.dump({"commit": commit_actual(), "resultados": resultados}, archivo, ensure_ascii=False, indent=2)
+    if args.comparar and comparar(resultados, args.comparar, args.tolerancia):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+class CacheLRU:
+    # Caché en memoria del proceso: acotada por tamaño (LRU) y con expiración (TTL)
+    def __init__(self, tamano_maximo: int, ttl: float):
+        self.tamano_maximo = tamano_maximo
+        self.ttl = ttl
+        self._datos = OrderedDict()
+        # Generación por llave, incrementada en cada invalidación; acotada a tamano_maximo llaves:
+        # al descartar una se incrementa la época y toda ficha anterior deja de ser válida
+        self._generaciones = OrderedDict()
+        self._epoca = 0
+        self.aciertos = 0
+        self.fallos = 0
+        self.desalojos = 0
+        self.rechazados = 0
+
+    def obtener(self, llave):
+        entrada = self._datos.get(llave)
+        if entrada is None:
+            self.fallos += 1
+            return None
+
+        expira, valor = entrada
+        if expira < time.monotonic():
+            del self._datos[llave]
+            self.fallos += 1
+            return None
+
+        self._datos.move_to_end(llave)
+        self.aciertos += 1
+        return valor
+
+    def ficha(self, llave):
+        # Se toma antes de consultar la fuente; guardar() la rechaza si hubo una invalidación en medio
+        return (self._epoca, self._generaciones.get(llave, 0))
+
+    def guardar(self, llave, valor, ficha=None):
+        if self.tamano_maximo <= 0:
+            return
+        if ficha is not None and ficha != self.ficha(llave):
+            # Lectura iniciada antes de una escritura: no debe sobrescribir la invalidación
+            self.rechazados += 1
+            return
+        self._datos[llave] = (time.monotonic() + self.ttl, valor)
+        self._datos.move_to_end(llave)
+        while len(self._datos) > self.tamano_maximo:
+            self._datos.popitem(last=False)
+            self.desalojos += 1
+
+    def invalidar(self, llave):
+        self._datos.pop(llave, None)
+        self._generaciones[llave] = self._generaciones.get(llave, 0) + 1
+        self._generaciones.move_to_end(llave)
+        if len(self._generaciones) > self.tamano_maximo:
+            self._generaciones.popitem(last=False)
+            self._epoca += 1
+
+    def estadisticas(self):
+        return {
+            "tamano": len(self._datos),
+            "tamanoMaximo": self.tamano_maximo,
+            "ttl": self.ttl,
+            "aciertos": self.aciertos,
+            "fallos": self.fallos,
+            "desalojos": self.desalojos,
+            "rechazados": self.rechazados,
+        }
+
+class Coalescedor:
+    # Single-flight: lecturas idénticas concurrentes comparten una sola consulta en vuelo
+    def __init__(self):
+        self._en_vuelo = {}
+        self.consultas = 0
+        self.colapsadas = 0
+        self.invalidaciones = 0
+
+    async def ejecutar(self, llave, funcion):
+        tarea = self._en_vuelo.get(llave)
+        if tarea is None:
+            self.consultas += 1
+            tarea = asyncio.ensure_future(funcion())
+            self._en_vuelo[llave] = tarea
+            tarea.add_done_callback(lambda _: self._terminar(llave, tarea))
+        else:
+            self.colapsadas += 1
+        # shield: si un cliente se desconecta, la consulta sigue para los demás
+        return await asyncio.shield(tarea)
+
+    def _terminar(self, llave, tarea):
+        # Solo se retira si sigue siendo la consulta vigente de la llave (no una ya invalidada)
+        if self._en_vuelo.get(llave) is tarea:
+            del self._en_vuelo[llave]
+
+    def invalidar(self, llave):
+        # Se llama después de confirmar una escritura: la consulta en vuelo pudo leer el documento
+        # anterior, así que las lecturas que lleguen a partir de ahora inician una nueva generación
+        # (quien ya esperaba la consulta anterior la conserva)
+        if self._en_vuelo.pop(llave, None) is not None:
+            self.invalidaciones += 1
+
+    def estadisticas(self):
+        return {
+            "enVuelo": len(self._en_vuelo),
+            "consultas": self.consultas,
+            "colapsadas": self.colapsadas,
+            "invalidaciones": self.invalidaciones,
+        }
@@ -0,0 +1,198 @@
+import argparse
+import json
+import os
+import time
+from datetime import datetime
+
+from pymongo import UpdateOne, DESCENDING
+
+from database import ConexionMongoDB
+
+TAMANO_BLOQUE_LECTURA = 1 << 20
+
+
+def leer_documentos(ruta):
+    # Lee un arreglo JSON o un archivo NDJSON documento por documento, sin cargarlo completo en memoria
+    decodificador = json.JSONDecoder()
+    with open(ruta, encoding="utf-8") as archivo:
+        buffer = archivo.read(TAMANO_BLOQUE_LECTURA)
+        posicion = 0
+        while True:
+            # Saltar espacios, comas y el corchete de apertura del arreglo
+            while posicion < len(buffer) and buffer[posicion] in " \t\r\n,[":
+                posicion += 1
+            if posicion >= len(buffer):
+                buffer = archivo.read(TAMANO_BLOQUE_LECTURA)
+                posicion = 0
+                if not buffer:
+                    return
+                continue
+            if buffer[posicion] == "]":
+                return
+
+            try:
+                documento, fin = decodificador.raw_decode(buffer, posicion)
+            except json.JSONDecodeError:
+                # Documento partido entre dos bloques: leer más y reintentar
+                mas = archivo.read(TAMANO_BLOQUE_LECTURA)
+                if not mas:
+                    raise
+                buffer = buffer[posicion:] + mas
+                posicion = 0
+                continue
+
+            yield documento
+            posicion = fin
+            if posicion > TAMANO_BLOQUE_LECTURA:
+                buffer = buffer[posicion:]
+                posicion = 0
+
+
+def fecha_iso(fecha):
+    # dd/mm/yyyy -> yyyy-mm-dd (el formato ordenable que usan los filtros por fecha)
+    try:
+        return datetime.strptime(fecha, "%d/%m/%Y").strftime("%Y-%m-%d")
+    except (TypeError, ValueError):
+        return None
+
+
+def normalizar_usuario(usuario, catalogo):
+    return usuario
+
+
+def normalizar_cita(cita, catalogo):
+    # Las citas creadas por la API guardan el id como idCita
+    if "idCita" not in cita and "id" in cita:
+        cita["idCita"] = cita.pop("id")
+    cita.setdefault("estatusCita", "Pendiente")
+    cita.setdefault("fechaRegistroISO", fecha_iso(cita.get("fechaRegistro")))
+    return cita
+
+
+def normalizar_refaccion(refaccion, catalogo):
+    # Completar los campos del modelo Refaccion con los del catálogo
+    base = catalogo.get(refaccion.get("idRefaccion"), {})
+    return {
+        "idRefaccion": refaccion.get("idRefaccion"),
+        "nombreRefaccion": refaccion.get("nombreRefaccion", base.get("nombreRefaccion")),
+        "precio": refaccion.get("precio", base.get("precio")),
+        "cantidad": refaccion.get("cantidad", 1),
+        "descripcion": refaccion.get("descripcion", base.get("descripcion")),
+        "estatus": refaccion.get("estatus", base.get("estatus")),
+    }
+
+
+def normalizar_reparacion(reparacion, catalogo):
+    # En reparacion.json idDispositivo es una lista [{"idDispositivo": n}]; el modelo usa un entero
+    dispositivo = reparacion.get("idDispositivo")
+    if isinstance(dispositivo, list):
+        reparacion["idDispositivo"] = dispositivo[0]["idDispositivo"] if dispositivo else None
+
+    # Los nombres de cliente y técnico se derivan de la cita (idUsuarioC / idUsuarioT)
+    reparacion.pop("nombreCliente", None)
+    reparacion.pop("nombreTécnico", None)
+
+    reparacion["refacciones"] = [normalizar_refaccion(r, catalogo) for r in reparacion.get("refacciones", [])]
+    return reparacion
+
+
+def normalizar_catalogo(refaccion, catalogo):
+    return normalizar_refaccion(refaccion, catalogo)
+
+
+# Orden de carga: el catálogo primero para completar las refacciones de las reparaciones
+ARCHIVOS = [
+    ("refacciones", "refacciones", "idRefaccion", normalizar_catalogo),
+    ("usuarios", "usuarios", "idUsuario", normalizar_usuario),
+    ("citas", "coleccion", "idCita", normalizar_cita),
+    ("reparacion", "reparacion", "idReparacion", normalizar_reparacion),
+]
+EXTENSIONES = [".json", ".ndjson"]
+
+
+def reemplazo_versionado(documento):
+    # Reemplazo como pipeline: el contenido viene del archivo y la versión avanza sobre la guardada
+    # (nunca vuelve a 1), así los ETag emitidos antes de la recarga dejan de coincidir
+    documento.pop("_id", None)
+    documento.pop("version", None)
+    return [{"$replaceWith": {"$mergeObjects": [
+        {"$literal": documento},
+        {"_id": "$_id", "version": {"$add": [{"$ifNull": ["$version", 0]}, 1]}},
+    ]}}]
+
+
+def cargar(coleccion, ruta, clave, normalizar, catalogo, tamano_lote):
+    # Upserts por lotes con bulk_write no ordenado; solo un lote vive en memoria
+    inicio = time.perf_counter()
+    total = 0
+    omitidos = 0
+    lote = []
+    for documento in leer_documentos(ruta):
+        documento = normalizar(documento, catalogo)
+        # Registros sin id: se cuentan y se omiten en lugar de abortar la carga
+        if documento.get(clave) is None:
+            omitidos += 1
+            continue
+        lote.append(UpdateOne({clave: documento[clave]}, reemplazo_versionado(documento), upsert=True))
+        if len(lote) >= tamano_lote:
+            coleccion.bulk_write(lote, ordered=False)
+            total += len(lote)
+            lote = []
+    if lote:
+        coleccion.bulk_write(lote, ordered=False)
+        total += len(lote)
+
+    duracion = time.perf_counter() - inicio
+    print(f"{os.path.basename(ruta)}: {total} documentos en {duracion:.1f} s ({total / max(duracion, 1e-9):.0f} docs/s)")
+    if omitidos:
+        print(f"{os.path.basename(ruta)}: {omitidos} registros sin '{clave}' omitidos")
+
+
+def completar_reparaciones(conexion):
+    # idUsuarioC / idUsuarioT de cada reparación a partir de su cita, resuelto en el servidor
+    conexion.reparacion.aggregate([
+        {"$match": {"idUsuarioC": {"$exists": False}}},
+        {"$lookup": {"from": "citas", "localField": "idCita", "foreignField": "idCita", "as": "cita"}},
+        {"$unwind": "$cita"},
+        {"$project": {"idUsuarioC": "$cita.idUsuarioC", "idUsuarioT": "$cita.idUsuarioT"}},
+        {"$merge": {"into": "reparacion", "on": "_id", "whenMatched": "merge", "whenNotMatched": "discard"}}
+    ])
+
+    # El contador de idReparacion debe quedar por encima de los ids cargados
+    ultima = conexion.reparacion.find_one({}, {"_id": 0, "idReparacion": 1}, sort=[("idReparacion", DESCENDING)])
+    if ultima is not None:
+        conexion.contadores.update_one(
+            {"_id": "idReparacion"}, {"$max": {"valor": ultima["idReparacion"]}}, upsert=True
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Carga los datos de BD/*.json (o *.ndjson) en MongoDB")
+    parser.add_argument("--directorio", default="BD")
+    parser.add_argument("--lote", type=int, default=1000, help="Documentos por bulk_write")
+    args = parser.parse_args()
+
+    conexion = ConexionMongoDB()
+    try:
+        conexion.crear_indices()
+
+        catalogo = {}
+        for archivo, atributo, clave, normalizar in ARCHIVOS:
+            rutas = [os.path.join(args.directorio, archivo + extension) for extension in EXTENSIONES]
+            ruta = next((ruta for ruta in rutas if os.path.exists(ruta)), None)
+            if ruta is None:
+                print(f"{archivo}: no existe, se omite")
+                continue
+            cargar(getattr(conexion, atributo), ruta, clave, normalizar, catalogo, args.lote)
+
+            # El catálogo de refacciones es pequeño: se conserva para completar las reparaciones
+            if atributo == "refacciones":
+                catalogo = {r["idRefaccion"]: r for r in conexion.refacciones.find({}, {"_id": 0})}
+
+        completar_reparaciones(conexion)
+    finally:
+        conexion.cerrar()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,174 @@
-from pymongo import MongoClient
+import asyncio
+import os
+
+from pymongo import MongoClient, IndexModel, ASCENDING, DESCENDING, ReturnDocument
+from pymongo.errors import CollectionInvalid
+from pymongo.monitoring import ConnectionPoolListener
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from monitoreo import MonitorComandos, RegistroOperacionesLentas, COLECCION_OPERACIONES_LENTAS
+
+# Índices requeridos por cada colección: (campos, único)
+INDICES = {
+    "citas": [
+        ([("idCita", ASCENDING)], True),
+        # (id, version) cubre la consulta de versión para los ETag de GET por id
+        ([("idCita", ASCENDING), ("version", ASCENDING)], False),
+        # Compuestos (filtro, idCita) para que la paginación por llave use el índice al ordenar
+        ([("estatusCita", ASCENDING), ("idCita", ASCENDING)], False),
+        ([("idUsuarioC", ASCENDING), ("idCita", ASCENDING)], False),
+        ([("idUsuarioT", ASCENDING), ("idCita", ASCENDING)], False),
+        ([("fechaRegistroISO", ASCENDING), ("idCita", ASCENDING)], False),
+    ],
+    "usuarios": [
+        ([("idUsuario", ASCENDING)], True),
+        ([("email", ASCENDING)], True),
+        ([("rolUsuario", ASCENDING), ("idUsuario", ASCENDING)], False),
+    ],
+    "reparacion": [
+        ([("idReparacion", ASCENDING)], True),
+        ([("idReparacion", ASCENDING), ("version", ASCENDING)], False),
+        ([("idCita", ASCENDING), ("idReparacion", ASCENDING)], False),
+        ([("estatus", ASCENDING), ("idReparacion", ASCENDING)], False),
+        ([("refacciones.idRefaccion", ASCENDING)], False),
+    ],
+    "refacciones": [
+        ([("idRefaccion", ASCENDING)], True),
+    ],
+}
+
+# Citas anteriores a fechaRegistroISO: se deriva de fechaRegistro (dd/mm/yyyy) en el servidor;
+# las fechas inválidas quedan en null para no volver a procesarlas. El documento cambia, así que
+# la versión avanza y los ETag emitidos antes dejan de coincidir
+FILTRO_SIN_FECHA_ISO = {"fechaRegistroISO": {"$exists": False}, "fechaRegistro": {"$type": "string"}}
+COMPLETAR_FECHA_ISO = [{"$set": {
+    "fechaRegistroISO": {"$dateToString": {
+        "format": "%Y-%m-%d",
+        "date": {"$dateFromString": {"dateString": "$fechaRegistro", "format": "%d/%m/%Y", "onError": None}},
+    }},
+    "version": {"$add": [{"$ifNull": ["$version", 0]}, 1]},
+}}]
+
+def modelos_indices(coleccion):
+    return [IndexModel(campos, unique=unico) for campos, unico in INDICES[coleccion]]
+
+def indices_faltantes(coleccion, informacion):
+    # Compara los índices declarados contra index_information() de la colección
+    existentes = {tuple(info["key"]): info.get("unique", False) for info in informacion.values()}
+    return [
+        (campos, unico) for campos, unico in INDICES[coleccion]
+        if tuple(campos) not in existentes or existentes[tuple(campos)] != unico
+    ]
+
+class MonitorPool(ConnectionPoolListener):
+    # Estadísticas del pool de conexiones del cliente (los eventos llegan desde hilos del driver)
+    def __init__(self):
+        self.creadas = 0
+        self.cerradas = 0
+        self.prestadas = 0
+        self.devueltas = 0
+        self.prestamos_fallidos = 0
+    def pool_created(self, event): pass
+    def pool_ready(self, event): pass
+    def pool_cleared(self, event): pass
+    def pool_closed(self, event): pass
+    def connection_created(self, event): self.creadas += 1
+    def connection_ready(self, event): pass
+    def connection_closed(self, event): self.cerradas += 1
+    def connection_check_out_started(self, event): pass
+    def connection_check_out_failed(self, event): self.prestamos_fallidos += 1
+    def connection_checked_out(self, event): self.prestadas += 1
+    def connection_checked_in(self, event): self.devueltas += 1
 
 class ConexionMongoDB:
     def __init__(self):
         self.cliente = MongoClient()
-        self.bd = self.cliente.TelcelAPI
+        self.bd = self.cliente[os.environ.get("BD_MONGO", "TelcelAPI")]
         self.coleccion = self.bd.citas
         self.reparacion = self.bd.reparacion
         self.usuarios = self.bd.usuarios
+        self.refacciones = self.bd.refacciones
+        self.contadores = self.bd.contadores
+    def crear_indices(self):
+        for nombre in INDICES:
+            self.bd[nombre].create_indexes(modelos_indices(nombre))
     def cerrar(self):
         self.cliente.close()
 
-        
\ No newline at end of file
+class ConexionMongoDBAsync:
+    # Variante asíncrona (Motor) para los endpoints: no bloquea el event loop de uvicorn
+    def __init__(self, tamano_bloque_ids=None):
+        self.monitor_pool = MonitorPool()
+        # Comandos enviados por cada petición HTTP (conteo, duración y presupuesto de consultas)
+        # y operaciones que superan el umbral de lentitud, con su plan de ejecución
+        self.registro_lento = RegistroOperacionesLentas()
+        self.monitor_comandos = MonitorComandos(self.registro_lento)
+        self.cliente = AsyncIOMotorClient(event_listeners=[self.monitor_pool, self.monitor_comandos])
+        self.bd = self.cliente[os.environ.get("BD_MONGO", "TelcelAPI")]
+        self.coleccion = self.bd.citas
+        self.reparacion = self.bd.reparacion
+        self.usuarios = self.bd.usuarios
+        self.refacciones = self.bd.refacciones
+        self.contadores = self.bd.contadores
+        self.operaciones_lentas = self.bd[COLECCION_OPERACIONES_LENTAS]
+        # Bloque de ids reservado por este proceso: nombre -> (último entregado, límite)
+        if tamano_bloque_ids is None:
+            tamano_bloque_ids = int(os.environ.get("TAMANO_BLOQUE_IDS", 1))
+        self.tamano_bloque_ids = tamano_bloque_ids
+        self._bloques_ids = {}
+        self._candado_ids = asyncio.Lock()
+    async def crear_indices(self):
+        # Crear (si no existen) y verificar los índices declarados en INDICES
+        for nombre in INDICES:
+            await self.bd[nombre].create_indexes(modelos_indices(nombre))
+        for nombre in INDICES:
+            faltantes = indices_faltantes(nombre, await self.bd[nombre].index_information())
+            if faltantes:
+                raise RuntimeError(f"Índices faltantes en '{nombre}': {faltantes}")
+    async def completar_fechas_iso(self):
+        # Idempotente: solo toca las citas que aún no tienen fechaRegistroISO
+        resultado = await self.coleccion.update_many(FILTRO_SIN_FECHA_ISO, COMPLETAR_FECHA_ISO)
+        return resultado.modified_count
+    async def crear_coleccion_limitada(self, nombre, tamano):
+        # Colección capped: conserva solo los documentos más recientes hasta 'tamano' bytes
+        try:
+            await self.bd.create_collection(nombre, capped=True, size=tamano)
+        except CollectionInvalid:
+            pass
+    async def inicializar_contador(self, nombre, coleccion, campo):
+        # Alinear el contador con el id más alto ya guardado (datos previos a los contadores)
+        ultimo = await coleccion.find_one({}, {"_id": 0, campo: 1}, sort=[(campo, DESCENDING)])
+        if ultimo is not None:
+            await self.contadores.update_one({"_id": nombre}, {"$max": {"valor": ultimo[campo]}}, upsert=True)
+    async def reservar_ids(self, nombre, cantidad):
+        # $inc atómico: devuelve el último id del rango reservado
+        contador = await self.contadores.find_one_and_update(
+            {"_id": nombre},
+            {"$inc": {"valor": cantidad}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        return contador["valor"]
+    async def siguiente_id(self, nombre):
+        # Id autoincremental atómico; con bloques de 1 el $inc basta y las peticiones no se esperan entre sí
+        if self.tamano_bloque_ids <= 1:
+            return await self.reservar_ids(nombre, 1)
+        # Con bloques > 1 solo se consulta Mongo al agotar el bloque, con el candado para no reservar dos a la vez
+        async with self._candado_ids:
+            actual, limite = self._bloques_ids.get(nombre, (0, 0))
+            if actual >= limite:
+                limite = await self.reservar_ids(nombre, self.tamano_bloque_ids)
+                actual = limite - self.tamano_bloque_ids
+            actual += 1
+            self._bloques_ids[nombre] = (actual, limite)
+            return actual
+    def estadisticas_pool(self):
+        pool = self.monitor_pool
+        return {
+            "conexionesAbiertas": pool.creadas - pool.cerradas,
+            "conexionesEnUso": pool.prestadas - pool.devueltas,
+            "prestamos": pool.prestadas,
+            "prestamosFallidos": pool.prestamos_fallidos,
+        }
+    def cerrar(self):
+        self.cliente.close()
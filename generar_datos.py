@@ -0,0 +1,218 @@
+import argparse
+import bisect
+import itertools
+import json
+import os
+import random
+import time
+from datetime import date, timedelta
+
+from database import ConexionMongoDB
+from cargar_datos import completar_reparaciones
+
+MARCAS = {
+    "Apple": ["IPhone 11", "IPhone 12", "IPhone 13", "IPhone 14 Pro"],
+    "Samsung": ["Galaxy S21", "Galaxy S23", "Galaxy A54", "Galaxy Z Flip 5"],
+    "Motorola": ["Moto G84", "Edge 40", "Moto E13"],
+    "Xiaomi": ["Redmi Note 12", "Redmi 13C", "Poco X5"],
+    "Huawei": ["P30 Lite", "Nova 11"],
+}
+FALLAS = [
+    ("Reparacion de celular", "La pantalla se rompió y no deja hacer nada", "Cambio de Pantalla"),
+    ("Cambio de batería", "La batería carga muy lento y dura muy poco", "Cambio de Batería"),
+    ("Reparacion de celular", "El puerto de carga no funciona", "Reemplazo de puerto de carga"),
+    ("Reparacion de celular", "La cámara trasera no enfoca", "Cambio de cámara"),
+    ("Revisión general", "El equipo se calienta y se reinicia solo", "Diagnóstico"),
+]
+# Estatus de cita con su peso relativo
+ESTATUS_CITA = [("Atendida", 55), ("Confirmada", 20), ("Pendiente", 15), ("Cancelada", 10)]
+ESTATUS_REPARACION = ["Finalizada", "En reparación", "Por confirmar reparación"]
+NOMBRES = ["Ana Maria", "Lucia", "Carlos", "Josue Eduardo", "Fernanda", "Miguel", "Sofia", "Diego", "Valeria", "Luis"]
+APELLIDOS = ["Garcia", "Hernandez", "Torres", "Mendez", "Perez", "Lopez", "Ramirez", "Cruz", "Flores", "Ortiz"]
+
+
+def pesos_zipf(n, s):
+    # Pesos acumulados 1/rango^s: pocos técnicos y clientes concentran la mayoría de las citas
+    return list(itertools.accumulate(1 / (rango ** s) for rango in range(1, n + 1)))
+
+
+def elegir(aleatorio, valores, acumulados):
+    return valores[bisect.bisect_left(acumulados, aleatorio.random() * acumulados[-1])]
+
+
+class DestinoNDJSON:
+    # Un archivo NDJSON por colección, con los nombres que espera cargar_datos.py
+    def __init__(self, directorio):
+        os.makedirs(directorio, exist_ok=True)
+        self.archivos = {}
+        self.directorio = directorio
+
+    def agregar(self, nombre, documento):
+        if nombre not in self.archivos:
+            self.archivos[nombre] = open(os.path.join(self.directorio, f"{nombre}.ndjson"), "w", encoding="utf-8")
+        self.archivos[nombre].write(json.dumps(documento, ensure_ascii=False) + "\n")
+
+    def cerrar(self):
+        for archivo in self.archivos.values():
+            archivo.close()
+
+
+class DestinoMongo:
+    # insert_many no ordenado por lotes, directo a las colecciones de la API
+    def __init__(self, tamano_lote):
+        self.conexion = ConexionMongoDB()
+        self.conexion.crear_indices()
+        self.colecciones = {
+            "refacciones": self.conexion.refacciones,
+            "usuarios": self.conexion.usuarios,
+            "citas": self.conexion.coleccion,
+            "reparacion": self.conexion.reparacion,
+        }
+        self.tamano_lote = tamano_lote
+        self.lotes = {nombre: [] for nombre in self.colecciones}
+
+    def agregar(self, nombre, documento):
+        lote = self.lotes[nombre]
+        lote.append(documento)
+        if len(lote) >= self.tamano_lote:
+            self.colecciones[nombre].insert_many(lote, ordered=False)
+            lote.clear()
+
+    def cerrar(self):
+        for nombre, lote in self.lotes.items():
+            if lote:
+                self.colecciones[nombre].insert_many(lote, ordered=False)
+        completar_reparaciones(self.conexion)
+        self.conexion.cerrar()
+
+
+def generar(destino, semilla, total_usuarios, total_citas, proporcion_tecnicos, total_refacciones):
+    aleatorio = random.Random(semilla)
+
+    # Catálogo de refacciones
+    catalogo = []
+    for idRefaccion in range(1, total_refacciones + 1):
+        marca = aleatorio.choice(list(MARCAS))
+        modelo = aleatorio.choice(MARCAS[marca])
+        pieza = aleatorio.choice(["Pantalla", "Batería", "Puerto de carga", "Cámara", "Tapa trasera"])
+        refaccion = {
+            "idRefaccion": idRefaccion,
+            "nombreRefaccion": f"{pieza} para {marca} {modelo}",
+            "precio": aleatorio.randrange(150, 3500, 50),
+            "cantidad": aleatorio.randint(0, 50),
+            "descripcion": f"{pieza} para {marca} {modelo}",
+            "estatus": "En existencia",
+        }
+        catalogo.append(refaccion)
+        # Copia: insert_many agrega _id al documento y el catálogo se reutiliza en las reparaciones
+        destino.agregar("refacciones", dict(refaccion))
+
+    # Usuarios: el primero es administrador, luego técnicos y el resto clientes
+    total_tecnicos = max(1, int(total_usuarios * proporcion_tecnicos))
+    inicio = date(2023, 1, 1)
+    for idUsuario in range(1, total_usuarios + 1):
+        if idUsuario == 1:
+            rol = "Administrador"
+        elif idUsuario <= 1 + total_tecnicos:
+            rol = "Tecnico"
+        else:
+            rol = "Cliente"
+        destino.agregar("usuarios", {
+            "idUsuario": idUsuario,
+            "nombre": aleatorio.choice(NOMBRES),
+            "apellidos": f"{aleatorio.choice(APELLIDOS)} {aleatorio.choice(APELLIDOS)}",
+            "fechaRegistro": (inicio + timedelta(days=aleatorio.randrange(730))).strftime("%d/%m/%Y"),
+            "email": f"usuario{idUsuario}@ejemplo.com",
+            "password": f"clave-{aleatorio.randrange(10 ** 8):08d}",
+            "telefono": f"{aleatorio.randrange(10 ** 10):010d}",
+            "rolUsuario": rol,
+            "version": 1,
+        })
+
+    # Distribuciones sesgadas de técnicos y clientes
+    tecnicos = list(range(2, 2 + total_tecnicos))
+    clientes = list(range(2 + total_tecnicos, total_usuarios + 1)) or tecnicos
+    acumulados_tecnicos = pesos_zipf(len(tecnicos), 1.1)
+    acumulados_clientes = pesos_zipf(len(clientes), 0.8)
+    # El orden de los clientes se baraja para que los frecuentes no sean siempre los ids bajos
+    aleatorio.shuffle(clientes)
+    estatus, pesos = zip(*ESTATUS_CITA)
+    acumulados_estatus = list(itertools.accumulate(pesos))
+
+    idReparacion = 0
+    for idCita in range(1, total_citas + 1):
+        registro = inicio + timedelta(days=aleatorio.randrange(730))
+        motivo, falla, tipo_reparacion = aleatorio.choice(FALLAS)
+        dispositivos = []
+        for idDispositivo in range(1, 1 + elegir(aleatorio, [1, 2, 3], [85, 97, 100])):
+            marca = aleatorio.choice(list(MARCAS))
+            dispositivos.append({
+                "idDispositivo": idDispositivo,
+                "marca": marca,
+                "modelo": aleatorio.choice(MARCAS[marca]),
+                "caracteristicasHardware": f"{aleatorio.choice([64, 128, 256, 512])} GB",
+                "fallas": falla,
+                "fotosDispositivo": f"../fotoDispositivo{idCita}_{idDispositivo}.img",
+            })
+        cita = {
+            "idCita": idCita,
+            "fechaRegistro": registro.strftime("%d/%m/%Y"),
+            "fechaRegistroISO": registro.isoformat(),
+            "fechaEntrega": (registro + timedelta(days=3)).strftime("%d/%m/%Y"),
+            "motivoCita": motivo,
+            "horaCita": f"{aleatorio.randint(9, 18):02d}:{aleatorio.choice(['00', '30'])}",
+            "estatusCita": elegir(aleatorio, estatus, acumulados_estatus),
+            "idUsuarioC": elegir(aleatorio, clientes, acumulados_clientes),
+            "idUsuarioT": elegir(aleatorio, tecnicos, acumulados_tecnicos),
+            "dispositivos": dispositivos,
+            "version": 1,
+        }
+        destino.agregar("citas", cita)
+
+        # Las citas confirmadas o atendidas tienen una reparación con 0 a 4 refacciones
+        if cita["estatusCita"] in ("Confirmada", "Atendida"):
+            idReparacion += 1
+            refacciones = [
+                {**refaccion, "cantidad": aleatorio.randint(1, 2)}
+                for refaccion in aleatorio.sample(catalogo, min(len(catalogo), elegir(aleatorio, [0, 1, 2, 3, 4], [15, 70, 90, 97, 100])))
+            ]
+            costo = aleatorio.randrange(0, 600, 50)
+            destino.agregar("reparacion", {
+                "idReparacion": idReparacion,
+                "tipoReparacion": tipo_reparacion,
+                "detalles": falla,
+                "estatus": "Finalizada" if cita["estatusCita"] == "Atendida" else aleatorio.choice(ESTATUS_REPARACION[1:]),
+                "costoServicio": costo,
+                "total": costo + sum(r["precio"] * r["cantidad"] for r in refacciones),
+                "idCita": idCita,
+                "idUsuarioC": cita["idUsuarioC"],
+                "idUsuarioT": cita["idUsuarioT"],
+                "idDispositivo": 1,
+                "refacciones": refacciones,
+                "version": 1,
+            })
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Genera un conjunto de datos sintético y determinista")
+    parser.add_argument("--semilla", type=int, default=575)
+    parser.add_argument("--usuarios", type=int, default=100_000)
+    parser.add_argument("--citas", type=int, default=1_000_000)
+    parser.add_argument("--refacciones", type=int, default=500, help="Tamaño del catálogo de refacciones")
+    parser.add_argument("--proporcion-tecnicos", type=float, default=0.02)
+    parser.add_argument("--salida", choices=["mongo", "ndjson"], default="ndjson")
+    parser.add_argument("--directorio", default="datos_sinteticos", help="Directorio de salida NDJSON")
+    parser.add_argument("--lote", type=int, default=5000, help="Documentos por insert_many")
+    args = parser.parse_args()
+
+    destino = DestinoMongo(args.lote) if args.salida == "mongo" else DestinoNDJSON(args.directorio)
+    inicio = time.perf_counter()
+    try:
+        generar(destino, args.semilla, args.usuarios, args.citas, args.proporcion_tecnicos, args.refacciones)
+    finally:
+        destino.cerrar()
+    print(f"{args.usuarios} usuarios y {args.citas} citas generados en {time.perf_counter() - inicio:.1f} s")
+
+
+if __name__ == '__main__':
+    main()
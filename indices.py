@@ -0,0 +1,36 @@
+import argparse
+
+from database import ConexionMongoDB, INDICES, indices_faltantes
+
+
+def reporte(conexion):
+    # Índices declarados que no existen y existentes que nunca se han usado ($indexStats)
+    for nombre in INDICES:
+        coleccion = conexion.bd[nombre]
+        print(f"== {nombre}")
+
+        for campos, unico in indices_faltantes(nombre, coleccion.index_information()):
+            print(f"  FALTANTE   {campos}{' (único)' if unico else ''}")
+
+        for estadistica in coleccion.aggregate([{"$indexStats": {}}]):
+            if estadistica["name"] == "_id_":
+                continue
+            operaciones = estadistica["accesses"]["ops"]
+            if operaciones == 0:
+                desde = estadistica["accesses"]["since"].strftime("%d/%m/%Y %H:%M")
+                print(f"  SIN USO    {estadistica['name']} (desde {desde})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reporte de índices faltantes o sin uso")
+    parser.parse_args()
+
+    conexion = ConexionMongoDB()
+    try:
+        reporte(conexion)
+    finally:
+        conexion.cerrar()
+
+
+if __name__ == '__main__':
+    main()
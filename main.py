@@ -1,42 +1,124 @@
-from fastapi import FastAPI
-from models import NuevaCita, ConfirmacionCita, Usuario, DatosActualizados, CredencialesUsuario, Reparacion, NuevaRefaccion, ActualizarRefaccion
-from database import ConexionMongoDB
+from fastapi import FastAPI, Query, Request, Response
+from models import NuevaCita, ConfirmacionCita, Usuario, DatosActualizados, CredencialesUsuario, Reparacion, NuevaRefaccion, ActualizarRefaccion, CambioEstatusCita, CAMPOS_USUARIO
+from database import ConexionMongoDBAsync
 from bson import json_util, ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError, BulkWriteError
 import json
 from fastapi import HTTPException, status
-from datetime import datetime, timedelta
-
-
-
-app = FastAPI()
+from datetime import datetime, timedelta, date
+from contextlib import asynccontextmanager
+from typing import List, Literal, Optional
+from paginacion import paginar, valor_inicial, codificar_cursor, decodificar_cursor, parsear_ids, obtener_por_ids, LIMITE_POR_DEFECTO, LIMITE_MAXIMO
+from respuestas import RespuestaORJSON, acepta_ndjson, respuesta_ndjson, etag_documento, coincide_etag
+from cache import CacheLRU, Coalescedor
+from metricas import RegistroMetricas, MiddlewareMetricas, metricas_simples
+from monitoreo import MiddlewareConsultas, token_admin_valido, COLECCION_OPERACIONES_LENTAS, TAMANO_OPERACIONES_LENTAS
+from perfilador import Perfiles, MiddlewarePerfilador, colapsar
+from fastapi.responses import PlainTextResponse
+import os
+
+
+
+# Instancia de la conexión asíncrona a MongoDB
+conexion_mongo = ConexionMongoDBAsync()
+
+# Caché de usuarios por idUsuario (tamaño y TTL configurables por despliegue)
+cache_usuarios = CacheLRU(
+    int(os.environ.get("CACHE_USUARIOS_TAMANO", 10000)),
+    float(os.environ.get("CACHE_USUARIOS_TTL", 60))
+)
+
+# Lecturas por id concurrentes e idénticas comparten una sola consulta a MongoDB
+coalescedor = Coalescedor()
+
+@asynccontextmanager
+async def ciclo_de_vida(app: FastAPI):
+    # Crear y verificar los índices antes de atender peticiones
+    await conexion_mongo.crear_indices()
+    # Los filtros desde/hasta usan fechaRegistroISO: completarlo en citas anteriores a ese campo
+    await conexion_mongo.completar_fechas_iso()
+    await conexion_mongo.inicializar_contador("idReparacion", conexion_mongo.reparacion, "idReparacion")
+    # Registro de operaciones lentas en una colección limitada
+    await conexion_mongo.crear_coleccion_limitada(COLECCION_OPERACIONES_LENTAS, TAMANO_OPERACIONES_LENTAS)
+    conexion_mongo.registro_lento.iniciar(conexion_mongo.cliente, conexion_mongo.operaciones_lentas, ruta_plantilla)
+    yield
+    # Cerrar la conexión al detener la aplicación
+    await conexion_mongo.registro_lento.detener()
+    conexion_mongo.cerrar()
+
+app = FastAPI(lifespan=ciclo_de_vida, default_response_class=RespuestaORJSON)
+
+# Métricas por ruta (plantilla), en curso y por código de estatus, expuestas en /metrics
+registro_metricas = RegistroMetricas(app.router)
+app.add_middleware(MiddlewareMetricas, registro=registro_metricas)
+# Comandos a MongoDB por petición: encabezado Server-Timing y advertencias de presupuesto / N+1
+app.add_middleware(MiddlewareConsultas)
+# Perfil por muestreo de una petición a pedido (X-Perfilar + X-Token-Admin); el más externo para cubrir todo
+perfiles = Perfiles()
+app.add_middleware(MiddlewarePerfilador, perfiles=perfiles)
+
+def ruta_plantilla(scope):
+    # "GET /citas/{idCita}" para una petición ya enrutada
+    ruta = registro_metricas.ruta_de(scope)
+    return f"{ruta.metodo} {ruta.ruta}"
+
+def metricas_adicionales():
+    # Pool de conexiones de MongoDB, caché de usuarios y coalescencia de lecturas
+    pool = conexion_mongo.estadisticas_pool()
+    cache = cache_usuarios.estadisticas()
+    return (
+        metricas_simples(
+            "mongo_pool",
+            contadores={"prestamos_total": pool["prestamos"], "prestamos_fallidos_total": pool["prestamosFallidos"]},
+            medidores={"conexiones_abiertas": pool["conexionesAbiertas"], "conexiones_en_uso": pool["conexionesEnUso"]}
+        )
+        + metricas_simples(
+            "cache_usuarios",
+            contadores={
+                "aciertos_total": cache["aciertos"],
+                "fallos_total": cache["fallos"],
+                "desalojos_total": cache["desalojos"],
+                "rechazados_total": cache["rechazados"],
+            },
+            medidores={"tamano": cache["tamano"]}
+        )
+        + metricas_simples(
+            "coalescencia",
+            contadores={
+                "consultas_total": coalescedor.consultas,
+                "colapsadas_total": coalescedor.colapsadas,
+                "invalidaciones_total": coalescedor.invalidaciones,
+            }
+        )
+        + metricas_simples(
+            "operaciones_lentas",
+            contadores={f"{nombre}_total": valor for nombre, valor in conexion_mongo.registro_lento.estadisticas().items()}
+        )
+    )
 
-# Instancia de la conexión a MongoDB
-conexion_mongo = ConexionMongoDB()
+registro_metricas.agregar_fuente(metricas_adicionales)
 
 @app.get("/")
 def read_root():
     return {"Hello": "World"}
 
 
-@app.post("/citas")
-async def crear_cita(cita: NuevaCita):
-    # Obtener el nombre del usuario cliente
-    usuario_cliente = conexion_mongo.usuarios.find_one({"idUsuario": cita.idUsuarioC})
-    if not usuario_cliente:
-        raise HTTPException(status_code=404, detail="Usuario cliente no encontrado")
-
+def documento_cita(cita: NuevaCita):
     # Generar la fecha de registro actual
     fecha_registro = datetime.now().strftime("%d/%m/%Y")
+    fecha_registro_iso = datetime.now().strftime("%Y-%m-%d")
 
     # Generar la fecha de entrega tres días después de la fecha de registro
     fecha_entrega = (datetime.now() + timedelta(days=3)).strftime("%d/%m/%Y")
 
-    # Guardar la cita en MongoDB
+    # Documento de la cita tal como se guarda en MongoDB
     cita_dict = cita.dict()
     dispositivos_dict = [disp.dict() for disp in cita.dispositivos]
-    cita_dispositivos = {
+    return {
         "idCita": cita_dict["id"],
         "fechaRegistro": fecha_registro,
+        "fechaRegistroISO": fecha_registro_iso,
         "fechaEntrega": fecha_entrega,
         "motivoCita": cita_dict["motivoCita"],
         "horaCita": cita_dict["horaCita"],
@@ -44,165 +126,311 @@ async def crear_cita(cita: NuevaCita):
         "idUsuarioC": cita_dict["idUsuarioC"],
         "idUsuarioT": cita_dict["idUsuarioT"],
         "dispositivos": dispositivos_dict,
+        "version": 1,
     }
-    cita_id = conexion_mongo.coleccion.insert_one(cita_dispositivos).inserted_id
+
+@app.post("/citas")
+async def crear_cita(cita: NuevaCita):
+    # Obtener el nombre del usuario cliente
+    usuario_cliente = await buscar_usuario(cita.idUsuarioC)
+    if not usuario_cliente:
+        raise HTTPException(status_code=404, detail="Usuario cliente no encontrado")
+
+    # Guardar la cita en MongoDB
+    try:
+        cita_id = (await conexion_mongo.coleccion.insert_one(documento_cita(cita))).inserted_id
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="La cita ya existe")
+    # Un GET en vuelo pudo haber leído "no existe": las lecturas siguientes no se unen a él
+    coalescedor.invalidar(("cita", cita.id))
 
     # Devolver un mensaje de confirmación y el nombre del usuario
     return {"mensaje": "Cita creada exitosamente", "nombreUsuario": usuario_cliente["nombre"]}
 
-@app.get("/citas")
-async def obtener_citas():
-    # Obtener todas las citas de la colección en MongoDB
-    citas = list(conexion_mongo.coleccion.find({}))
+# Máximo de elementos aceptados por los endpoints de lote
+LIMITE_LOTE = 1000
 
-    # Convertir ObjectId a cadenas y formatear los datos como se requiere
-    citas_formateadas = []
-    for cita in citas:
-        cita["_id"] = str(cita["_id"])
-        citas_formateadas.append(cita)
+@app.post("/citas/bulk")
+async def crear_citas_lote(citas: List[NuevaCita]):
+    if len(citas) > LIMITE_LOTE:
+        raise HTTPException(status_code=400, detail=f"El lote no puede tener más de {LIMITE_LOTE} citas")
 
-    # Devolver las citas como respuesta
-    return {"citas": citas_formateadas}
+    # Validar todos los usuarios cliente referenciados con una sola consulta $in
+    ids_clientes = list({cita.idUsuarioC for cita in citas})
+    clientes_existentes = {
+        usuario["idUsuario"]
+        async for usuario in conexion_mongo.usuarios.find({"idUsuario": {"$in": ids_clientes}}, {"_id": 0, "idUsuario": 1})
+    }
 
-@app.put("/citas/{idCita}/confirmar")
-async def confirmar_cita(idCita: int):
-    # Verificar si la cita existe en la base de datos
-    cita = conexion_mongo.coleccion.find_one({"idCita": idCita})
+    resultados = [None] * len(citas)
+    documentos = []
+    posiciones = []
+    for posicion, cita in enumerate(citas):
+        if cita.idUsuarioC not in clientes_existentes:
+            resultados[posicion] = {"idCita": cita.id, "estatus": False, "mensaje": "Usuario cliente no encontrado"}
+        else:
+            documentos.append(documento_cita(cita))
+            posiciones.append(posicion)
+
+    # Inserción no ordenada: un error (p. ej. idCita duplicado) no detiene el resto del lote
+    errores = {}
+    if documentos:
+        try:
+            await conexion_mongo.coleccion.insert_many(documentos, ordered=False)
+        except BulkWriteError as error:
+            for error_escritura in error.details["writeErrors"]:
+                errores[error_escritura["index"]] = (
+                    "La cita ya existe" if error_escritura["code"] == 11000 else error_escritura["errmsg"]
+                )
+        for documento in documentos:
+            coalescedor.invalidar(("cita", documento["idCita"]))
+
+    for indice, posicion in enumerate(posiciones):
+        resultados[posicion] = {
+            "idCita": citas[posicion].id,
+            "estatus": indice not in errores,
+            "mensaje": errores.get(indice, "Cita creada exitosamente")
+        }
+
+    return {"resultados": resultados}
+
+@app.get("/citas")
+async def obtener_citas(
+    request: Request,
+    after: Optional[int] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(LIMITE_POR_DEFECTO, ge=1, le=LIMITE_MAXIMO),
+    orden: Literal["asc", "desc"] = "asc",
+    estatusCita: Optional[str] = None,
+    idUsuarioT: Optional[int] = None,
+    idUsuarioC: Optional[int] = None,
+    desde: Optional[date] = None,
+    hasta: Optional[date] = None,
+    ids: Optional[str] = None
+):
+    # Varias citas por id en una sola consulta (?ids=1,2,3)
+    if ids is not None:
+        citas, faltantes = await obtener_por_ids(conexion_mongo.coleccion, "idCita", parsear_ids(ids))
+        return RespuestaORJSON({"citas": citas, "faltantes": faltantes})
+
+    # Construir el filtro con los parámetros recibidos
+    filtro = {}
+    if estatusCita is not None:
+        filtro["estatusCita"] = estatusCita
+    if idUsuarioT is not None:
+        filtro["idUsuarioT"] = idUsuarioT
+    if idUsuarioC is not None:
+        filtro["idUsuarioC"] = idUsuarioC
+    if desde is not None or hasta is not None:
+        filtro["fechaRegistroISO"] = {}
+        if desde is not None:
+            filtro["fechaRegistroISO"]["$gte"] = desde.isoformat()
+        if hasta is not None:
+            filtro["fechaRegistroISO"]["$lte"] = hasta.isoformat()
+
+    # Exportación completa en streaming cuando se pide NDJSON
+    if acepta_ndjson(request):
+        return respuesta_ndjson(conexion_mongo.coleccion.find(filtro).sort("idCita", 1))
+
+    # Obtener una página de citas ordenada por idCita
+    citas, siguiente = await paginar(
+        conexion_mongo.coleccion, filtro, "idCita", valor_inicial(after, cursor), limit, orden
+    )
+
+    # Devolver las citas y el cursor de la página siguiente (orjson convierte el ObjectId)
+    return RespuestaORJSON({"citas": citas, "siguiente": siguiente})
+
+# Máquina de estados de las citas: estatus destino -> estatus de origen permitidos
+# ("En espera de confirmación" viene de los datos originales y equivale a Pendiente;
+# None: cualquier estatus de origen, como en la cancelación original)
+TRANSICIONES_CITA = {
+    "Confirmada": ["Pendiente", "En espera de confirmación"],
+    "Atendida": ["Confirmada"],
+    "Cancelada": None,
+}
+
+def transicion_permitida(origen, estatus_destino: str):
+    origenes = TRANSICIONES_CITA[estatus_destino]
+    return origen != estatus_destino if origenes is None else origen in origenes
+
+def filtro_transicion(idCita: int, estatus_destino: str):
+    # El filtro solo acepta los estatus de origen válidos para el destino
+    origenes = TRANSICIONES_CITA[estatus_destino]
+    condicion = {"$ne": estatus_destino} if origenes is None else {"$in": origenes}
+    return {"idCita": idCita, "estatusCita": condicion}
+
+def actualizacion_transicion(estatus_destino: str):
+    return {"$set": {"estatusCita": estatus_destino}, "$inc": {"version": 1}}
+
+async def transicionar_cita(idCita: int, estatus_destino: str):
+    # Una sola operación condicional sobre los estatus de origen permitidos
+    cita = await conexion_mongo.coleccion.find_one_and_update(
+        filtro_transicion(idCita, estatus_destino),
+        actualizacion_transicion(estatus_destino),
+        projection={"_id": 0, "estatusCita": 1}
+    )
+    if cita is not None:
+        # Lecturas posteriores a la escritura no deben unirse a una consulta iniciada antes
+        coalescedor.invalidar(("cita", idCita))
+        return True
+
+    # Solo si no se aplicó: distinguir cita inexistente, ya en destino o transición inválida
+    cita = await conexion_mongo.coleccion.find_one({"idCita": idCita}, {"_id": 0, "estatusCita": 1})
     if not cita:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="La cita no existe")
+    if cita.get("estatusCita") == estatus_destino:
+        return False
+    raise HTTPException(
+        status_code=status.HTTP_409_CONFLICT,
+        detail=f"La cita con ID {idCita} está {cita.get('estatusCita')} y no puede pasar a {estatus_destino}."
+    )
 
-    # Verificar si la cita ya está confirmada
-    if cita.get("estatusCita") == "Confirmada":
+@app.put("/citas/{idCita}/confirmar")
+async def confirmar_cita(idCita: int):
+    # Actualizar el estado de la cita a "Confirmada" si está pendiente
+    if not await transicionar_cita(idCita, "Confirmada"):
         return {"mensaje": f"La cita con ID {idCita} ya está confirmada."}
 
-    # Actualizar el estado de la cita a "Confirmada"
-    conexion_mongo.coleccion.update_one({"idCita": idCita}, {"$set": {"estatusCita": "Confirmada"}})
-
     # Devolver una respuesta exitosa
     return {"mensaje": f"Cita con ID {idCita} confirmada exitosamente."}
 
 @app.put("/citas/{idCita}/cancelar")
 async def cancelar_cita(idCita: int):
-    # Verificar si la cita existe en la base de datos
-    cita = conexion_mongo.coleccion.find_one({"idCita": idCita})
-    if not cita:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="La cita no existe")
-
-    # Verificar si la cita ya está cancelada
-    if cita.get("estatusCita") == "Cancelada":
+    # Actualizar el estado de la cita a "Cancelada" si aún no fue atendida
+    if not await transicionar_cita(idCita, "Cancelada"):
         return {"mensaje": f"La cita con ID {idCita} ya está cancelada."}
 
-    # Actualizar el estado de la cita a "Cancelada"
-    conexion_mongo.coleccion.update_one({"idCita": idCita}, {"$set": {"estatusCita": "Cancelada"}})
-
     # Devolver una respuesta exitosa
     return {"mensaje": f"Cita con ID {idCita} cancelada exitosamente."}
 
 @app.put("/citas/{idCita}/finalizar")
 async def finalizar_cita(idCita: int):
-    # Verificar si la cita existe en la base de datos
-    cita = conexion_mongo.coleccion.find_one({"idCita": idCita})
-    if not cita:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="La cita no existe")
-
-    # Verificar si la cita ya está cancelada
-    if cita.get("estatusCita") == "Cancelada":
-        return {"mensaje": f"La cita con ID {idCita} fue cancelada."}
-    
-    if cita.get("estatusCita") == "Atendida":
+    # Actualizar el estado de la cita a "Atendida" si está confirmada
+    if not await transicionar_cita(idCita, "Atendida"):
         return {"mensaje": f"La cita con ID {idCita} fue atendida."}
 
-    # Actualizar el estado de la cita a "Cancelada"
-    conexion_mongo.coleccion.update_one({"idCita": idCita}, {"$set": {"estatusCita": "Atendida"}})
-
     # Devolver una respuesta exitosa
     return {"mensaje": f"Cita con ID {idCita} fue atendida exitosamente."}
 
+@app.put("/citas/estatus")
+async def cambiar_estatus_citas(cambios: List[CambioEstatusCita]):
+    if len(cambios) > LIMITE_LOTE:
+        raise HTTPException(status_code=400, detail=f"El lote no puede tener más de {LIMITE_LOTE} cambios")
+
+    # Estatus actual de todas las citas del lote en una sola consulta
+    estatus_actual = {
+        cita["idCita"]: cita.get("estatusCita")
+        async for cita in conexion_mongo.coleccion.find(
+            {"idCita": {"$in": list({cambio.idCita for cambio in cambios})}}, {"_id": 0, "idCita": 1, "estatusCita": 1}
+        )
+    }
+
+    # Validar cada cambio con la misma máquina de estados; los válidos se acumulan para bulk_write
+    resultados = []
+    operaciones = []
+    for cambio in cambios:
+        resultado = {"idCita": cambio.idCita, "estatusCita": cambio.estatusCita}
+        origen = estatus_actual.get(cambio.idCita)
+        if cambio.estatusCita not in TRANSICIONES_CITA:
+            resultado.update(estatus=False, codigo=400, mensaje=f"Estatus {cambio.estatusCita} no válido")
+        elif cambio.idCita not in estatus_actual:
+            resultado.update(estatus=False, codigo=404, mensaje="La cita no existe")
+        elif origen == cambio.estatusCita:
+            resultado.update(estatus=True, codigo=200, mensaje=f"La cita ya está {cambio.estatusCita}")
+        elif not transicion_permitida(origen, cambio.estatusCita):
+            resultado.update(estatus=False, codigo=409, mensaje=f"La cita está {origen} y no puede pasar a {cambio.estatusCita}")
+        else:
+            resultado.update(estatus=True, codigo=200, mensaje=f"Cita cambiada a {cambio.estatusCita}")
+            operaciones.append(UpdateOne(
+                filtro_transicion(cambio.idCita, cambio.estatusCita), actualizacion_transicion(cambio.estatusCita)
+            ))
+            # Cambios encadenados de la misma cita dentro del lote parten del nuevo estatus
+            estatus_actual[cambio.idCita] = cambio.estatusCita
+        resultados.append(resultado)
+
+    if operaciones:
+        # Ordenado para respetar los cambios encadenados; el filtro vuelve a validar el origen en el servidor
+        escritura = await conexion_mongo.coleccion.bulk_write(operaciones, ordered=True)
+        for idCita in estatus_actual:
+            coalescedor.invalidar(("cita", idCita))
+
+        # Si otra petición cambió alguna cita entre la lectura y la escritura, revisar el estatus final
+        if escritura.matched_count < len(operaciones):
+            estatus_final = {
+                cita["idCita"]: cita.get("estatusCita")
+                async for cita in conexion_mongo.coleccion.find(
+                    {"idCita": {"$in": list(estatus_actual)}}, {"_id": 0, "idCita": 1, "estatusCita": 1}
+                )
+            }
+            for resultado in resultados:
+                idCita = resultado["idCita"]
+                if resultado["estatus"] and estatus_final.get(idCita) != estatus_actual[idCita]:
+                    resultado.update(estatus=False, codigo=409, mensaje="La cita cambió de estatus durante el lote")
+
+    return {"resultados": resultados}
+
+async def version_actual(coleccion, campo: str, valor: int):
+    # Solo la versión del documento (consulta cubierta por el índice (campo, version))
+    documento = await coleccion.find_one({campo: valor}, {"_id": 0, "version": 1})
+    return None if documento is None else documento.get("version", 0)
+
 @app.get("/citas/{idCita}")
-async def obtener_cita(idCita: int):
-    # Buscar la cita en la base de datos
-    cita = conexion_mongo.coleccion.find_one({"idCita": idCita})
+async def obtener_cita(idCita: int, request: Request):
+    # Si el cliente ya tiene la versión actual, responder 304 sin leer la cita completa
+    if request.headers.get("if-none-match"):
+        version = await version_actual(conexion_mongo.coleccion, "idCita", idCita)
+        etag = etag_documento("cita", idCita, version)
+        if version is not None and coincide_etag(request, etag):
+            return Response(status_code=304, headers={"ETag": etag})
+
+    # Buscar la cita en la base de datos (compartiendo la consulta con peticiones simultáneas)
+    cita = await coalescedor.ejecutar(("cita", idCita), lambda: conexion_mongo.coleccion.find_one({"idCita": idCita}))
     
     # Verificar si la cita existe
     if not cita:
         raise HTTPException(status_code=404, detail="Cita no encontrada")
 
-    # Convertir el _id de ObjectId a string
-    cita["_id"] = str(cita["_id"])
-
     # Devolver los detalles completos de la cita
-    return cita
+    return RespuestaORJSON(cita, headers={"ETag": etag_documento("cita", idCita, cita.get("version", 0))})
 
 @app.post("/usuarios")
 async def crear_usuario(usuario: Usuario):
-    # Verificar si el usuario ya existe
-    if conexion_mongo.usuarios.find_one({"idUsuario": usuario.idUsuario}):
-        raise HTTPException(status_code=400, detail="El usuario ya existe")
-
     # Generar la fecha de registro actual
     fecha_registro = datetime.now().strftime("%d/%m/%Y")
 
     # Convertir el usuario a un diccionario y agregar la fecha de registro
     usuario_dict = usuario.dict()
     usuario_dict["fechaRegistro"] = fecha_registro
-
-    # Insertar el usuario en la base de datos
-    usuario_id = conexion_mongo.usuarios.insert_one(usuario_dict).inserted_id
+    usuario_dict["version"] = 1
+
+    # Insertar el usuario; los índices únicos de idUsuario y email rechazan duplicados
+    try:
+        usuario_id = (await conexion_mongo.usuarios.insert_one(usuario_dict)).inserted_id
+    except DuplicateKeyError as error:
+        if "email" in (error.details or {}).get("keyPattern", {}):
+            raise HTTPException(status_code=409, detail="El correo electrónico ya está registrado")
+        raise HTTPException(status_code=400, detail="El usuario ya existe")
+    cache_usuarios.invalidar(usuario.idUsuario)
 
     # Devolver una respuesta exitosa con el ID del nuevo usuario
     return {"mensaje": "Usuario creado y guardado en MongoDB con éxito", "usuario_id": str(usuario_id)}
 
-@app.get("/usuarios")
-async def obtener_usuarios():
-    # Recuperar todos los usuarios de la base de datos
-    usuarios = list(conexion_mongo.usuarios.find({}, {
-        "_id": 0,
-        "idUsuario": 1,
-        "nombre": 1,
-        "apellidos": 1,
-        "telefono": 1,
-        "email": 1,
-        "password": 1,
-        "rolUsuario": 1
-    }))
-
+# Campos de usuario que se devuelven en las consultas
+PROYECCION_USUARIO = {
+    "_id": 0,
+    "idUsuario": 1,
+    "nombre": 1,
+    "apellidos": 1,
+    "telefono": 1,
+    "email": 1,
+    "password": 1,
+    "rolUsuario": 1,
+    "version": 1
+}
+
+def formatear_usuario(usuario):
     # Construir la respuesta en el formato especificado
-    usuarios_formateados = [
-        {
-            "idUsuario": usuario["idUsuario"],
-            "nombre": usuario["nombre"],
-            "apellidos": usuario["apellidos"],
-            "telefono": usuario["telefono"],
-            "correoElectronico": usuario["email"],
-            "contraseña": usuario["password"],
-            "rol": usuario["rolUsuario"]
-        }
-        for usuario in usuarios
-    ]
-
-    respuesta = {"usuarios": usuarios_formateados}
-
-    return respuesta
-
-@app.get("/usuarios/{idUsuario}")
-async def obtener_usuario_por_id(idUsuario: int):
-    # Buscar el usuario por idUsuario en la base de datos
-    usuario = conexion_mongo.usuarios.find_one({"idUsuario": idUsuario}, {
-        "_id": 0,
-        "idUsuario": 1,
-        "nombre": 1,
-        "apellidos": 1,
-        "telefono": 1,
-        "email": 1,
-        "password": 1,
-        "rolUsuario": 1
-    })
-
-    if not usuario:
-        raise HTTPException(status_code=404, detail="Usuario no encontrado")
-
-    # Construir la respuesta en el formato especificado
-    respuesta = {
+    return {
         "idUsuario": usuario["idUsuario"],
         "nombre": usuario["nombre"],
         "apellidos": usuario["apellidos"],
@@ -212,34 +440,108 @@ async def obtener_usuario_por_id(idUsuario: int):
         "rol": usuario["rolUsuario"]
     }
 
-    return respuesta
+async def buscar_usuario(idUsuario: int):
+    # Consultar primero la caché; solo se guardan usuarios existentes
+    usuario = cache_usuarios.obtener(idUsuario)
+    if usuario is None:
+        # La ficha evita guardar un perfil leído antes de una actualización ya invalidada
+        ficha = cache_usuarios.ficha(idUsuario)
+        usuario = await conexion_mongo.usuarios.find_one({"idUsuario": idUsuario}, PROYECCION_USUARIO)
+        if usuario is not None:
+            cache_usuarios.guardar(idUsuario, usuario, ficha)
+    return usuario
 
-@app.put("/usuarios/{idUsuario}")
-async def actualizar_perfil_usuario(idUsuario: int, datos_actualizados: DatosActualizados):
-    # Verificar si el usuario existe en la base de datos
-    usuario_existente = conexion_mongo.usuarios.find_one({"idUsuario": idUsuario})
-    if not usuario_existente:
+@app.get("/usuarios")
+async def obtener_usuarios(
+    request: Request,
+    after: Optional[int] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(LIMITE_POR_DEFECTO, ge=1, le=LIMITE_MAXIMO),
+    orden: Literal["asc", "desc"] = "asc",
+    rol: Optional[str] = None,
+    ids: Optional[str] = None
+):
+    # Varios usuarios por id: primero la caché y una sola consulta $in para el resto
+    if ids is not None:
+        ids_pedidos = parsear_ids(ids)
+        en_cache = {}
+        for idUsuario in ids_pedidos:
+            usuario = cache_usuarios.obtener(idUsuario)
+            if usuario is not None:
+                en_cache[idUsuario] = usuario
+        fichas = {i: cache_usuarios.ficha(i) for i in ids_pedidos if i not in en_cache}
+        consultados, faltantes = await obtener_por_ids(
+            conexion_mongo.usuarios, "idUsuario", list(fichas), PROYECCION_USUARIO
+        )
+        for usuario in consultados:
+            cache_usuarios.guardar(usuario["idUsuario"], usuario, fichas[usuario["idUsuario"]])
+            en_cache[usuario["idUsuario"]] = usuario
+        usuarios = [formatear_usuario(en_cache[i]) for i in ids_pedidos if i in en_cache]
+        return RespuestaORJSON({"usuarios": usuarios, "faltantes": faltantes})
+
+    # Construir el filtro con los parámetros recibidos
+    filtro = {}
+    if rol is not None:
+        filtro["rolUsuario"] = rol
+
+    # Exportación completa en streaming cuando se pide NDJSON
+    if acepta_ndjson(request):
+        return respuesta_ndjson(
+            conexion_mongo.usuarios.find(filtro, PROYECCION_USUARIO).sort("idUsuario", 1), formatear_usuario
+        )
+
+    # Recuperar una página de usuarios ordenada por idUsuario
+    usuarios, siguiente = await paginar(
+        conexion_mongo.usuarios, filtro, "idUsuario", valor_inicial(after, cursor), limit, orden, PROYECCION_USUARIO
+    )
+
+    respuesta = {"usuarios": [formatear_usuario(usuario) for usuario in usuarios], "siguiente": siguiente}
+
+    return RespuestaORJSON(respuesta)
+
+@app.get("/usuarios/{idUsuario}")
+async def obtener_usuario_por_id(idUsuario: int, request: Request):
+    # Buscar el usuario por idUsuario (caché o base de datos)
+    usuario = await buscar_usuario(idUsuario)
+
+    if not usuario:
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
 
-    # Actualizar los detalles del perfil del usuario
-    cambios_realizados = False
-    for campo, valor in datos_actualizados.dict().items():
-        if campo in usuario_existente and usuario_existente[campo] != valor:
-            conexion_mongo.usuarios.update_one(
-                {"idUsuario": idUsuario},
-                {"$set": {campo: valor}}
-            )
-            cambios_realizados = True
-
-    if cambios_realizados:
+    # Responder 304 sin serializar si el cliente ya tiene esta versión
+    etag = etag_documento("usuario", idUsuario, usuario.get("version", 0))
+    if coincide_etag(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+
+    return RespuestaORJSON(formatear_usuario(usuario), headers={"ETag": etag})
+
+@app.put("/usuarios/{idUsuario}")
+async def actualizar_perfil_usuario(idUsuario: int, datos_actualizados: DatosActualizados):
+    # Traducir los campos de la API a los campos almacenados (correoElectronico -> email, ...)
+    cambios = {CAMPOS_USUARIO[campo]: valor for campo, valor in datos_actualizados.dict().items()}
+
+    # Diferencia calculada en el servidor: solo coincide si algún campo es distinto al guardado
+    try:
+        usuario = await conexion_mongo.usuarios.find_one_and_update(
+            {"idUsuario": idUsuario, "$or": [{campo: {"$ne": valor}} for campo, valor in cambios.items()]},
+            {"$set": cambios, "$inc": {"version": 1}},
+            projection={"_id": 1}
+        )
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="El correo electrónico ya está registrado")
+
+    if usuario is not None:
+        cache_usuarios.invalidar(idUsuario)
         return {"estatus": True, "mensaje": "Perfil de usuario actualizado correctamente."}
-    else:
-        return {"estatus": False, "mensaje": "No se realizaron cambios en el perfil del usuario."}
+
+    # Sin coincidencia: el usuario no existe o no hubo cambios
+    if not await conexion_mongo.usuarios.find_one({"idUsuario": idUsuario}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="Usuario no encontrado")
+    return {"estatus": False, "mensaje": "No se realizaron cambios en el perfil del usuario."}
 
 @app.post("/usuarios/validar")
 async def validar_credenciales(credenciales: CredencialesUsuario):
     # Buscar el usuario por nombreUsuario en la base de datos
-    usuario = conexion_mongo.usuarios.find_one({"email": credenciales.email})
+    usuario = await conexion_mongo.usuarios.find_one({"email": credenciales.email})
     
     if not usuario:
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
@@ -253,15 +555,8 @@ async def validar_credenciales(credenciales: CredencialesUsuario):
 
 @app.post("/reparaciones")
 async def agregar_reparacion(reparacion: Reparacion):
-    # Generar un idReparacion único y autoincremental
-    ultimo_reparacion = conexion_mongo.reparacion.find_one(
-        sort=[("idReparacion", -1)]
-    )
-    nuevo_id_reparacion = 1 if ultimo_reparacion is None else ultimo_reparacion["idReparacion"] + 1
-
     # Convertir la reparación a un diccionario
     reparacion_dict = reparacion.dict()
-    reparacion_dict["idReparacion"] = nuevo_id_reparacion
 
     # Convertir fechas a string para que sean compatibles con BSON
     if "fechaInicio" in reparacion_dict:
@@ -270,162 +565,282 @@ async def agregar_reparacion(reparacion: Reparacion):
         reparacion_dict["fechaFin"] = reparacion_dict["fechaFin"].strftime("%Y-%m-%d")
 
     # Verificar si la cita existe en la base de datos
-    cita = conexion_mongo.coleccion.find_one({"idCita": reparacion_dict["idCita"]})
+    cita = await conexion_mongo.coleccion.find_one({"idCita": reparacion_dict["idCita"]})
     if not cita:
         raise HTTPException(status_code=404, detail="Cita no encontrada")
 
+    # Generar un idReparacion único y autoincremental desde el contador atómico
+    reparacion_dict["idReparacion"] = await conexion_mongo.siguiente_id("idReparacion")
+    reparacion_dict["version"] = 1
+
     # Guardar la reparación en la base de datos
-    conexion_mongo.reparacion.insert_one(reparacion_dict)
+    await conexion_mongo.reparacion.insert_one(reparacion_dict)
+    coalescedor.invalidar(("reparacion", reparacion_dict["idReparacion"]))
 
     # Devolver una respuesta exitosa
     return {"estatus": True, "mensaje": "Reparación agregada exitosamente"}
 
+# Campos de reparación que se devuelven en el listado
+PROYECCION_REPARACION = {
+    "_id": 0,
+    "idReparacion": 1,
+    "tipoReparacion": 1,
+    "detalles": 1,
+    "estatus": 1,
+    "costoServicio": 1,
+    "total": 1,
+    "idCita": 1,
+    "idUsuarioC": 1,
+    "idUsuarioT": 1,
+    "idDispositivo": 1,
+    "refacciones.idReparacion": 1,
+    "refacciones.idRefaccion": 1,
+    "refacciones.nombreRefaccion": 1,
+    "refacciones.precio": 1,
+    "refacciones.cantidad": 1,
+    "refacciones.descripcion": 1,
+    "refacciones.estatus": 1
+}
+
 @app.get("/reparaciones")
-async def consultar_reparaciones():
-    # Consulta para recuperar las reparaciones
-    reparaciones_cursor = conexion_mongo.reparacion.find(
-        {"refacciones": {"$exists": True}},
-        {
-            "_id": 0,
-            "tipoReparacion": 1,
-            "detalles": 1,
-            "estatus": 1,
-            "costoServicio": 1,
-            "total": 1,
-            "idCita": 1,
-            "idUsuarioC": 1,
-            "idUsuarioT": 1,
-            "idDispositivo": 1,
-            "refacciones.idReparacion": 1,
-            "refacciones.idRefaccion": 1,
-            "refacciones.nombreRefaccion": 1,
-            "refacciones.precio": 1,
-            "refacciones.cantidad": 1,
-            "refacciones.descripcion": 1,
-            "refacciones.estatus": 1
-        }
+async def consultar_reparaciones(
+    request: Request,
+    after: Optional[int] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(LIMITE_POR_DEFECTO, ge=1, le=LIMITE_MAXIMO),
+    orden: Literal["asc", "desc"] = "asc",
+    estatus: Optional[str] = None,
+    idCita: Optional[int] = None,
+    ids: Optional[str] = None
+):
+    # Varias reparaciones por id en una sola consulta (?ids=1,2,3)
+    if ids is not None:
+        reparaciones, faltantes = await obtener_por_ids(conexion_mongo.reparacion, "idReparacion", parsear_ids(ids))
+        return RespuestaORJSON({"reparaciones": reparaciones, "faltantes": faltantes})
+
+    # Construir el filtro con los parámetros recibidos
+    filtro = {"refacciones": {"$exists": True}}
+    if estatus is not None:
+        filtro["estatus"] = estatus
+    if idCita is not None:
+        filtro["idCita"] = idCita
+
+    # Exportación completa en streaming cuando se pide NDJSON
+    if acepta_ndjson(request):
+        return respuesta_ndjson(conexion_mongo.reparacion.find(filtro, PROYECCION_REPARACION).sort("idReparacion", 1))
+
+    # Consulta para recuperar una página de reparaciones ordenada por idReparacion
+    reparaciones, siguiente = await paginar(
+        conexion_mongo.reparacion, filtro, "idReparacion", valor_inicial(after, cursor), limit, orden, PROYECCION_REPARACION
     )
 
-    # Convertir el cursor en una lista de reparaciones
-    reparaciones = list(reparaciones_cursor)
-
-    # Verificar si hay reparaciones
-    if not reparaciones:
-        return {"reparaciones": []}
-
-    return {"reparaciones": reparaciones}
+    return RespuestaORJSON({"reparaciones": reparaciones, "siguiente": siguiente})
 
 @app.get("/reparaciones/{idReparacion}")
-async def consultar_reparacion_por_id(idReparacion: int):
-    # Consulta para recuperar la reparación por su ID
-    reparacion = conexion_mongo.reparacion.find_one({"idReparacion": idReparacion})
+async def consultar_reparacion_por_id(idReparacion: int, request: Request):
+    # Si el cliente ya tiene la versión actual, responder 304 sin leer la reparación completa
+    if request.headers.get("if-none-match"):
+        version = await version_actual(conexion_mongo.reparacion, "idReparacion", idReparacion)
+        etag = etag_documento("reparacion", idReparacion, version)
+        if version is not None and coincide_etag(request, etag):
+            return Response(status_code=304, headers={"ETag": etag})
+
+    # Consulta para recuperar la reparación por su ID (compartida con peticiones simultáneas)
+    reparacion = await coalescedor.ejecutar(
+        ("reparacion", idReparacion), lambda: conexion_mongo.reparacion.find_one({"idReparacion": idReparacion})
+    )
 
     # Verificar si la reparación existe
     if not reparacion:
         return {"mensaje": "Reparación no encontrada"}
 
-    # Convertir el ObjectId a str para que sea JSON serializable
-    reparacion["_id"] = str(reparacion["_id"])
-
     # Devolver los datos de la reparación en un diccionario
-    return reparacion
+    etag = etag_documento("reparacion", idReparacion, reparacion.get("version", 0))
+    return RespuestaORJSON(reparacion, headers={"ETag": etag})
 
 @app.put("/reparaciones/{idReparacion}")
 async def actualizar_reparacion(idReparacion: int, reparacion_data: dict):
     # Verificar si la reparación existe en la base de datos
-    existing_reparacion = conexion_mongo.reparacion.find_one({"idReparacion": idReparacion})
+    existing_reparacion = await conexion_mongo.reparacion.find_one({"idReparacion": idReparacion})
     if existing_reparacion is None:
         raise HTTPException(status_code=404, detail="Reparación no encontrada")
 
     # Crear un diccionario de actualización con los datos proporcionados en el cuerpo
-    update_data = {key: value for key, value in reparacion_data.items() if value is not None}
+    # (la versión y el _id los administra el servidor)
+    update_data = {
+        key: value for key, value in reparacion_data.items()
+        if value is not None and key not in ("_id", "version")
+    }
 
     # Actualizar la reparación en la base de datos con los nuevos datos
-    conexion_mongo.reparacion.update_one({"idReparacion": idReparacion}, {"$set": update_data})
+    await conexion_mongo.reparacion.update_one(
+        {"idReparacion": idReparacion}, {"$set": update_data, "$inc": {"version": 1}}
+    )
+    coalescedor.invalidar(("reparacion", idReparacion))
 
     return {"mensaje": "Reparación actualizada exitosamente"}
 
 
 @app.post("/refacciones")
 async def agregar_refaccion(refaccion: NuevaRefaccion):
-    # Verificar si la reparación existe en la base de datos
-    reparacion = conexion_mongo.reparacion.find_one({"idReparacion": refaccion.idReparacion})
-    if not reparacion:
-        raise HTTPException(status_code=404, detail="La reparación no existe")
-
-    # Verificar si la refacción ya existe en el arreglo 'refacciones' de la reparación
-    refacciones_existentes = reparacion.get("refacciones", [])
-    for ref in refacciones_existentes:
-        if ref["idRefaccion"] == refaccion.idRefaccion:
-            raise HTTPException(status_code=400, detail="La refacción ya existe en la reparación")
-
-    # Agregar la nueva refacción al arreglo 'refacciones' del documento de reparación
-    conexion_mongo.reparacion.update_one(
-        {"idReparacion": refaccion.idReparacion},
-        {"$push": {"refacciones": refaccion.dict()}}
+    # Agregar la refacción solo si no existe ya en el arreglo 'refacciones' (una sola operación atómica)
+    resultado = await conexion_mongo.reparacion.update_one(
+        {"idReparacion": refaccion.idReparacion, "refacciones.idRefaccion": {"$ne": refaccion.idRefaccion}},
+        {"$push": {"refacciones": refaccion.dict()}, "$inc": {"version": 1}}
     )
+    coalescedor.invalidar(("reparacion", refaccion.idReparacion))
+
+    # Si no se agregó, distinguir reparación inexistente de refacción duplicada
+    if resultado.matched_count == 0:
+        if not await conexion_mongo.reparacion.find_one({"idReparacion": refaccion.idReparacion}, {"_id": 1}):
+            raise HTTPException(status_code=404, detail="La reparación no existe")
+        raise HTTPException(status_code=400, detail="La refacción ya existe en la reparación")
 
     return {"estatus": True, "mensaje": "Refacción agregada exitosamente"}
 
 @app.get("/refacciones")
-async def consultar_refacciones():
-    # Consultar todas las reparaciones en la base de datos
-    reparaciones = list(conexion_mongo.reparacion.find({}, {"_id": 0}))
-
-    # Extraer las refacciones de cada reparación y agregarlas a una lista independiente
-    refacciones = []
-    for reparacion in reparaciones:
-        refacciones.extend(reparacion.get("refacciones", []))
-
-    return {"refacciones": refacciones}
+async def consultar_refacciones(
+    cursor: Optional[str] = None,
+    limit: int = Query(LIMITE_POR_DEFECTO, ge=1, le=LIMITE_MAXIMO),
+    estatus: Optional[str] = None,
+    idRefaccion: Optional[int] = None
+):
+    # Filtro sobre los campos de cada refacción
+    filtro_refaccion = {}
+    if estatus is not None:
+        filtro_refaccion["estatus"] = estatus
+    if idRefaccion is not None:
+        filtro_refaccion["idRefaccion"] = idRefaccion
+
+    # Descartar en el servidor las reparaciones sin refacciones que coincidan
+    coincidencia = {"refacciones.0": {"$exists": True}}
+    if filtro_refaccion:
+        coincidencia["refacciones"] = {"$elemMatch": filtro_refaccion}
+
+    # Paginación por llave (idReparacion, posición en el arreglo): el orden sale del índice
+    filtro_pagina = {f"refacciones.{campo}": valor for campo, valor in filtro_refaccion.items()}
+    if cursor:
+        try:
+            ultima_reparacion, ultima_posicion = decodificar_cursor(cursor)
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="Cursor inválido")
+        coincidencia["idReparacion"] = {"$gte": ultima_reparacion}
+        filtro_pagina["$or"] = [
+            {"idReparacion": {"$gt": ultima_reparacion}},
+            {"idReparacion": ultima_reparacion, "posicion": {"$gt": ultima_posicion}}
+        ]
+
+    # Desenrollar y enviar únicamente los subdocumentos de refacción
+    refacciones = await conexion_mongo.reparacion.aggregate([
+        {"$match": coincidencia},
+        {"$sort": {"idReparacion": 1}},
+        {"$project": {"_id": 0, "idReparacion": 1, "refacciones": 1}},
+        {"$unwind": {"path": "$refacciones", "includeArrayIndex": "posicion"}},
+        {"$match": filtro_pagina},
+        {"$limit": limit + 1},
+        {"$replaceRoot": {"newRoot": {
+            "$mergeObjects": ["$refacciones", {"idReparacion": "$idReparacion", "posicion": "$posicion"}]
+        }}}
+    ]).to_list(length=limit + 1)
+
+    siguiente = None
+    if len(refacciones) > limit:
+        refacciones = refacciones[:limit]
+        siguiente = codificar_cursor([refacciones[-1]["idReparacion"], refacciones[-1]["posicion"]])
+    for refaccion in refacciones:
+        del refaccion["posicion"]
+
+    return RespuestaORJSON({"refacciones": refacciones, "siguiente": siguiente})
 
 @app.get("/refacciones/{idReparacion}/{idRefaccion}")
 async def consultar_refaccion_por_id(idReparacion: int, idRefaccion: int):
-    # Consultar la reparación por su ID
-    reparacion = conexion_mongo.reparacion.find_one({"idReparacion": idReparacion}, {"_id": 0, "refacciones": 1})
+    # Consultar la reparación proyectando solo la refacción buscada ($elemMatch)
+    reparacion = await conexion_mongo.reparacion.find_one(
+        {"idReparacion": idReparacion},
+        {"_id": 0, "refacciones": {"$elemMatch": {"idRefaccion": idRefaccion}}}
+    )
 
-    # Verificar si la reparación existe
-    if not reparacion:
+    # Verificar si la reparación existe (sin coincidencias la proyección devuelve {}, que sí existe)
+    if reparacion is None:
         return {"mensaje": "Reparación no encontrada"}
 
-    # Obtener las refacciones de la reparación
-    refacciones = reparacion.get("refacciones", [])
-
-    # Buscar la refacción por su idRefaccion
-    refaccion_encontrada = next((refaccion for refaccion in refacciones if refaccion.get("idRefaccion") == idRefaccion), None)
-
-    if not refaccion_encontrada:
+    # Sin coincidencias, la proyección omite el arreglo
+    if not reparacion.get("refacciones"):
         return {"mensaje": "Refacción no encontrada"}
 
-    return {"refaccion": refaccion_encontrada}
+    return {"refaccion": reparacion["refacciones"][0]}
 
 @app.put("/refacciones/{idReparacion}/{idRefaccion}")
 async def actualizar_refaccion(idReparacion: int, idRefaccion: int, refaccion_actualizada: ActualizarRefaccion):
-    # Consultar la reparación que contiene la refacción
-    reparacion = conexion_mongo.reparacion.find_one({"idReparacion": idReparacion, "refacciones.idRefaccion": idRefaccion})
-
-    # Verificar si la reparación existe
-    if not reparacion:
-        raise HTTPException(status_code=404, detail="La reparación que contiene la refacción no fue encontrada")
-
-    # Buscar la refacción por su idRefaccion dentro de la lista de refacciones de la reparación
-    refaccion_index = next((index for index, refaccion in enumerate(reparacion["refacciones"]) if refaccion["idRefaccion"] == idRefaccion), None)
-
-    if refaccion_index is None:
-        raise HTTPException(status_code=404, detail="La refacción no fue encontrada en la reparación")
-
-    # Actualizar los datos de la refacción
-    conexion_mongo.reparacion.update_one(
+    # Actualizar la refacción en su posición con el operador posicional $
+    resultado = await conexion_mongo.reparacion.update_one(
         {"idReparacion": idReparacion, "refacciones.idRefaccion": idRefaccion},
         {"$set": {
-            f"refacciones.{refaccion_index}.nombreRefaccion": refaccion_actualizada.nombre,
-            f"refacciones.{refaccion_index}.cantidad": refaccion_actualizada.cantidad,
-            f"refacciones.{refaccion_index}.precio": refaccion_actualizada.precioUnitario
-        }}
+            "refacciones.$.nombreRefaccion": refaccion_actualizada.nombre,
+            "refacciones.$.cantidad": refaccion_actualizada.cantidad,
+            "refacciones.$.precio": refaccion_actualizada.precioUnitario
+        }, "$inc": {"version": 1}}
     )
+    coalescedor.invalidar(("reparacion", idReparacion))
+
+    # Verificar si la reparación con esa refacción existe
+    if resultado.matched_count == 0:
+        raise HTTPException(status_code=404, detail="La reparación que contiene la refacción no fue encontrada")
 
     return {"estatus": True, "mensaje": "Detalles de refacción actualizados correctamente"}
 
+@app.get("/monitoreo/cache")
+async def estadisticas_cache():
+    # Aciertos, fallos y desalojos de la caché de usuarios
+    return {"usuarios": cache_usuarios.estadisticas()}
+
+@app.get("/monitoreo/coalescencia")
+async def estadisticas_coalescencia():
+    # Consultas ejecutadas y consultas evitadas por compartir una en vuelo
+    return coalescedor.estadisticas()
+
+@app.get("/metrics")
+async def metricas():
+    # Métricas en formato de texto de Prometheus
+    return PlainTextResponse(registro_metricas.exportar(), media_type="text/plain; version=0.0.4")
+
+def verificar_admin(request: Request):
+    if not token_admin_valido(request.headers.get("X-Token-Admin")):
+        raise HTTPException(status_code=403, detail="No autorizado")
+
+@app.get("/admin/operaciones-lentas")
+async def consultar_operaciones_lentas(
+    request: Request,
+    ruta: Optional[str] = None,
+    plan: Optional[str] = None,
+    limite: int = Query(LIMITE_POR_DEFECTO, ge=1, le=LIMITE_MAXIMO)
+):
+    verificar_admin(request)
+    filtro = {}
+    if ruta:
+        filtro["ruta"] = ruta
+    if plan:
+        filtro["plan"] = plan
+    # Orden natural inverso de la colección limitada: las más recientes primero
+    cursor = conexion_mongo.operaciones_lentas.find(filtro, {"_id": 0}).sort("$natural", -1).limit(limite)
+    return {
+        "operaciones": await cursor.to_list(length=limite),
+        "registro": conexion_mongo.registro_lento.estadisticas(),
+    }
+
+@app.get("/admin/perfiles")
+async def consultar_perfiles(request: Request):
+    verificar_admin(request)
+    return perfiles.listar()
+
+@app.get("/admin/perfiles/{idPerfil}")
+async def obtener_perfil(idPerfil: int, request: Request):
+    verificar_admin(request)
+    perfil = perfiles.obtener(idPerfil)
+    if perfil is None:
+        raise HTTPException(status_code=404, detail="Perfil no encontrado")
+    # Pilas colapsadas, listas para flamegraph.pl o speedscope
+    return PlainTextResponse(colapsar(perfil["muestras"]))
 
 
 if __name__ == '__main__':
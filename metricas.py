@@ -0,0 +1,127 @@
+import bisect
+import time
+
+# Límites superiores (segundos) de las cubetas del histograma de latencia
+CUBETAS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Métodos que se usan como etiqueta; cualquier otro (lo envía el cliente) se agrupa en OTRO
+METODOS = {"GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"}
+
+
+class MetricasRuta:
+    # Contadores de una ruta; se crea una sola vez por endpoint, no por petición
+    __slots__ = ("metodo", "ruta", "cubetas", "suma", "total", "por_estatus")
+
+    def __init__(self, metodo, ruta):
+        self.metodo = metodo
+        self.ruta = ruta
+        self.cubetas = [0] * (len(CUBETAS) + 1)
+        self.suma = 0.0
+        self.total = 0
+        self.por_estatus = {}
+
+
+class RegistroMetricas:
+    # Todas las actualizaciones ocurren en el event loop sin await intermedio, por lo que no se usan candados
+    def __init__(self, router):
+        self.router = router
+        self.rutas = {}
+        self.en_curso = 0
+        self.fuentes = []
+
+    def ruta_de(self, scope):
+        # Una entrada por (endpoint, método de la petición): un 405 o una ruta inexistente llevan su propio método
+        metodo = scope["method"] if scope["method"] in METODOS else "OTRO"
+        llave = (scope.get("endpoint"), metodo)
+        metricas = self.rutas.get(llave)
+        if metricas is None:
+            # Primera petición de esta combinación: resolver la plantilla de la ruta (/citas/{idCita})
+            endpoint = llave[0]
+            plantilla = "sin_ruta"
+            if endpoint is not None:
+                for ruta in self.router.routes:
+                    if getattr(ruta, "endpoint", None) is endpoint:
+                        plantilla = ruta.path
+                        break
+            metricas = self.rutas[llave] = MetricasRuta(metodo, plantilla)
+        return metricas
+
+    def observar(self, scope, estatus, duracion):
+        metricas = self.ruta_de(scope)
+        metricas.cubetas[bisect.bisect_left(CUBETAS, duracion)] += 1
+        metricas.suma += duracion
+        metricas.total += 1
+        metricas.por_estatus[estatus] = metricas.por_estatus.get(estatus, 0) + 1
+
+    def agregar_fuente(self, funcion):
+        # Funciones que devuelven líneas adicionales ya formateadas (pool de Mongo, cachés, ...)
+        self.fuentes.append(funcion)
+
+    def exportar(self):
+        # Formato de texto de Prometheus
+        lineas = [
+            "# HELP api_peticiones_en_curso Peticiones HTTP en curso",
+            "# TYPE api_peticiones_en_curso gauge",
+            f"api_peticiones_en_curso {self.en_curso}",
+            "# HELP api_peticiones_total Peticiones HTTP atendidas por ruta y código de estatus",
+            "# TYPE api_peticiones_total counter",
+        ]
+        rutas = list(self.rutas.values())
+        for m in rutas:
+            for estatus, cantidad in m.por_estatus.items():
+                lineas.append(f'api_peticiones_total{{metodo="{m.metodo}",ruta="{m.ruta}",estatus="{estatus}"}} {cantidad}')
+
+        lineas += [
+            "# HELP api_duracion_segundos Latencia de las peticiones HTTP por ruta",
+            "# TYPE api_duracion_segundos histogram",
+        ]
+        for m in rutas:
+            etiquetas = f'metodo="{m.metodo}",ruta="{m.ruta}"'
+            acumulado = 0
+            for limite, cantidad in zip(CUBETAS, m.cubetas):
+                acumulado += cantidad
+                lineas.append(f'api_duracion_segundos_bucket{{{etiquetas},le="{limite}"}} {acumulado}')
+            lineas.append(f'api_duracion_segundos_bucket{{{etiquetas},le="+Inf"}} {m.total}')
+            lineas.append(f"api_duracion_segundos_sum{{{etiquetas}}} {m.suma}")
+            lineas.append(f"api_duracion_segundos_count{{{etiquetas}}} {m.total}")
+
+        for fuente in self.fuentes:
+            lineas += fuente()
+        return "\n".join(lineas) + "\n"
+
+
+class MiddlewareMetricas:
+    # Middleware ASGI puro: mide cada petición HTTP y la registra con la plantilla de su ruta
+    def __init__(self, app, registro: RegistroMetricas):
+        self.app = app
+        self.registro = registro
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        registro = self.registro
+        registro.en_curso += 1
+        inicio = time.perf_counter()
+        estatus = 500
+
+        async def enviar(mensaje):
+            nonlocal estatus
+            if mensaje["type"] == "http.response.start":
+                estatus = mensaje["status"]
+            await send(mensaje)
+
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            registro.en_curso -= 1
+            registro.observar(scope, estatus, time.perf_counter() - inicio)
+
+
+def metricas_simples(prefijo, contadores=None, medidores=None):
+    # Líneas de Prometheus para valores sueltos: contadores (counter) y medidores (gauge)
+    lineas = []
+    for tipo, valores in (("counter", contadores or {}), ("gauge", medidores or {})):
+        for nombre, valor in valores.items():
+            lineas.append(f"# TYPE {prefijo}_{nombre} {tipo}")
+            lineas.append(f"{prefijo}_{nombre} {valor}")
+    return lineas
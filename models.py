@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import List
+from typing import List, Literal
 from datetime import date
 from typing import Optional
 
@@ -11,11 +11,14 @@ class Dispositivo(BaseModel):
     fallas: str
     fotosDispositivo: str
 
+# Estatus válidos de una cita ("En espera de confirmación" solo aparece en datos anteriores)
+EstatusCita = Literal["Pendiente", "En espera de confirmación", "Confirmada", "Atendida", "Cancelada"]
+
 class NuevaCita(BaseModel):
     id: int
     motivoCita: str
     horaCita: str
-    estatusCita: str = "Pendiente"  
+    estatusCita: EstatusCita = "Pendiente"
     idUsuarioC: int
     idUsuarioT: int
     dispositivos: List[Dispositivo]
@@ -23,6 +26,10 @@ class NuevaCita(BaseModel):
 class ConfirmacionCita(BaseModel):
     mensaje: str
 
+class CambioEstatusCita(BaseModel):
+    idCita: int
+    estatusCita: str
+
 class Usuario(BaseModel):
     idUsuario: int
     nombre: str
@@ -39,6 +46,15 @@ class DatosActualizados(BaseModel):
     correoElectronico: str
     contraseña: str
 
+# Campo de DatosActualizados -> campo almacenado en la colección de usuarios
+CAMPOS_USUARIO = {
+    "nombre": "nombre",
+    "apellidos": "apellidos",
+    "telefono": "telefono",
+    "correoElectronico": "email",
+    "contraseña": "password",
+}
+
 class CredencialesUsuario(BaseModel):
     email: str
     contraseña: str
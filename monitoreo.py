@@ -0,0 +1,312 @@
+import asyncio
+import contextvars
+import hmac
+import json
+import logging
+import os
+import random
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+from pymongo.monitoring import CommandListener
+
+logger = logging.getLogger("telcel.monitoreo")
+
+# Comandos a MongoDB permitidos por petición antes de registrar una advertencia
+PRESUPUESTO_CONSULTAS = int(os.environ.get("PRESUPUESTO_CONSULTAS", 10))
+# Repeticiones del mismo comando sobre la misma colección que se reportan como posible N+1
+UMBRAL_N_MAS_1 = int(os.environ.get("UMBRAL_N_MAS_1", 5))
+
+# Operaciones lentas: umbral, fracción a la que se le corre explain y tamaño de la colección limitada
+UMBRAL_OPERACION_LENTA_MS = float(os.environ.get("UMBRAL_OPERACION_LENTA_MS", 100))
+MUESTREO_EXPLAIN = float(os.environ.get("MUESTREO_EXPLAIN", 0.1))
+TAMANO_OPERACIONES_LENTAS = int(os.environ.get("TAMANO_OPERACIONES_LENTAS", 16 * 1024 * 1024))
+COLECCION_OPERACIONES_LENTAS = "operacionesLentas"
+
+# Token de los endpoints /admin; sin TOKEN_ADMIN definido quedan deshabilitados
+TOKEN_ADMIN = os.environ.get("TOKEN_ADMIN")
+
+# Petición en curso; Motor copia el contexto al hilo que ejecuta cada operación del driver
+peticion_actual = contextvars.ContextVar("peticion_actual", default=None)
+
+
+def token_admin_valido(valor):
+    return bool(TOKEN_ADMIN) and valor is not None and hmac.compare_digest(valor, TOKEN_ADMIN)
+
+
+class ConsultasPeticion:
+    # Comandos de una petición; list.append es atómico, los hilos de Motor escriben sin candado
+    __slots__ = ("scope", "comandos", "duraciones")
+
+    def __init__(self, scope=None):
+        self.scope = scope
+        self.comandos = []
+        self.duraciones = []
+
+    def total(self):
+        return len(self.comandos)
+
+    def consultas(self):
+        # Sin getMore: recorrer un cursor por lotes (p. ej. una exportación NDJSON) es una sola consulta
+        return sum(1 for comando, _ in self.comandos if comando != "getMore")
+
+    def duracion_ms(self):
+        return sum(self.duraciones) / 1000
+
+    def repetidos(self, umbral):
+        return [
+            (comando, veces) for comando, veces in Counter(self.comandos).most_common()
+            if veces >= umbral and comando[0] != "getMore"
+        ]
+
+
+def coleccion_de(evento):
+    # find, insert, update, aggregate, findAndModify... llevan la colección como valor del comando
+    if evento.command_name == "getMore":
+        return evento.command.get("collection")
+    valor = evento.command.get(evento.command_name)
+    return valor if isinstance(valor, str) else None
+
+
+# Partes del comando que definen la forma de la consulta
+CAMPOS_FORMA = {
+    "find": ("filter", "sort", "projection"),
+    "aggregate": ("pipeline",),
+    "count": ("query",),
+    "distinct": ("key", "query"),
+    "findAndModify": ("query", "sort", "update"),
+    "update": ("updates",),
+    "delete": ("deletes",),
+}
+# Comandos de lectura a los que se les puede correr explain sin modificar datos
+COMANDOS_EXPLICABLES = {"find", "aggregate", "count", "distinct"}
+# Campos de sesión y del protocolo que explain no acepta dentro del comando
+CAMPOS_SESION = {"lsid", "txnNumber", "autocommit", "startTransaction", "readConcern", "writeConcern"}
+
+
+def forma(valor):
+    # Sustituye los valores por "?" conservando campos y operadores; las listas de documentos ($or, pipeline) se deduplican
+    if isinstance(valor, dict):
+        return {llave: forma(v) for llave, v in valor.items()}
+    if isinstance(valor, list) and valor and all(isinstance(v, dict) for v in valor):
+        formas = {}
+        for v in valor:
+            f = forma(v)
+            formas.setdefault(json.dumps(f), f)
+        return list(formas.values())
+    return "?"
+
+
+def forma_comando(nombre, comando):
+    partes = {campo: forma(comando[campo]) for campo in CAMPOS_FORMA.get(nombre, ()) if campo in comando}
+    return json.dumps(partes, ensure_ascii=False)
+
+
+def comando_explicable(nombre, comando):
+    if nombre not in COMANDOS_EXPLICABLES:
+        return None
+    if nombre == "aggregate" and any("$out" in etapa or "$merge" in etapa for etapa in comando.get("pipeline", [])):
+        return None
+    return {llave: valor for llave, valor in comando.items() if not llave.startswith("$") and llave not in CAMPOS_SESION}
+
+
+def buscar_llave(documento, llave):
+    # Todos los valores de 'llave' a cualquier profundidad (la salida de explain cambia entre find, aggregate y SBE)
+    if isinstance(documento, dict):
+        for k, v in documento.items():
+            if k == llave:
+                yield v
+            yield from buscar_llave(v, llave)
+    elif isinstance(documento, list):
+        for v in documento:
+            yield from buscar_llave(v, llave)
+
+
+def resumir_explain(explain):
+    etapas = {etapa for plan in buscar_llave(explain, "winningPlan") for etapa in buscar_llave(plan, "stage")}
+    if "COLLSCAN" in etapas:
+        plan = "COLLSCAN"
+    elif any("IXSCAN" in etapa or etapa in ("IDHACK", "COUNT_SCAN", "DISTINCT_SCAN") for etapa in etapas):
+        plan = "IXSCAN"
+    else:
+        plan = "+".join(sorted(etapas)) or None
+    estadisticas = next(buscar_llave(explain, "executionStats"), {})
+    examinados = estadisticas.get("totalDocsExamined", 0)
+    devueltos = estadisticas.get("nReturned", 0)
+    return {
+        "plan": plan,
+        "etapas": sorted(etapas),
+        "docsExaminados": examinados,
+        "llavesExaminadas": estadisticas.get("totalKeysExamined", 0),
+        "docsDevueltos": devueltos,
+        "proporcionExaminadosDevueltos": examinados / max(devueltos, 1),
+    }
+
+
+class RegistroOperacionesLentas:
+    # Los eventos llegan desde hilos del driver; el explain y la escritura corren en una tarea del event loop
+    def __init__(self, umbral_ms=UMBRAL_OPERACION_LENTA_MS, muestreo=MUESTREO_EXPLAIN, tamano_cola=1000):
+        self.umbral_micros = umbral_ms * 1000
+        self.muestreo = muestreo
+        self.tamano_cola = tamano_cola
+        self.loop = None
+        self.cola = None
+        self.tarea = None
+        self.cliente = None
+        self.coleccion = None
+        self.ruta_de = None
+        self.capturadas = 0
+        self.explicadas = 0
+        self.descartadas = 0
+
+    @property
+    def activo(self):
+        return self.loop is not None
+
+    def iniciar(self, cliente, coleccion, ruta_de=None):
+        self.loop = asyncio.get_running_loop()
+        self.cola = asyncio.Queue(self.tamano_cola)
+        self.cliente = cliente
+        self.coleccion = coleccion
+        self.ruta_de = ruta_de
+        self.tarea = asyncio.create_task(self._procesar())
+
+    async def detener(self):
+        self.loop = None
+        if self.tarea is not None:
+            self.tarea.cancel()
+            try:
+                await self.tarea
+            except asyncio.CancelledError:
+                pass
+
+    def capturar(self, operacion, comando, scope):
+        # Hilo del driver: solo se entrega la operación al event loop
+        loop = self.loop
+        if loop is None:
+            return
+        try:
+            loop.call_soon_threadsafe(self._encolar, operacion, comando, scope)
+        except RuntimeError:
+            # El loop ya se cerró
+            pass
+
+    def _encolar(self, operacion, comando, scope):
+        if self.ruta_de is not None and scope is not None:
+            operacion["ruta"] = self.ruta_de(scope)
+        try:
+            self.cola.put_nowait((operacion, comando))
+            self.capturadas += 1
+        except asyncio.QueueFull:
+            self.descartadas += 1
+
+    async def _procesar(self):
+        while True:
+            operacion, comando = await self.cola.get()
+            try:
+                if comando is not None and random.random() < self.muestreo:
+                    explain = await self.cliente[operacion["baseDatos"]].command(
+                        {"explain": comando, "verbosity": "executionStats"}
+                    )
+                    operacion.update(resumir_explain(explain))
+                    self.explicadas += 1
+                await self.coleccion.insert_one(operacion)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("No se pudo registrar la operación lenta %s", operacion.get("forma"))
+
+    def estadisticas(self):
+        return {"capturadas": self.capturadas, "explicadas": self.explicadas, "descartadas": self.descartadas}
+
+
+class MonitorComandos(CommandListener):
+    # Los comandos sin petición en curso (arranque, tareas de fondo) no se cuentan por petición
+    def __init__(self, registro_lento=None):
+        self.registro_lento = registro_lento
+        # Comandos en vuelo por (conexión, request_id): los eventos de fin no traen el comando
+        self._pendientes = {}
+
+    def started(self, event):
+        consultas = peticion_actual.get()
+        coleccion = coleccion_de(event)
+        if consultas is not None:
+            consultas.comandos.append((event.command_name, coleccion))
+        if (
+            self.registro_lento is not None and self.registro_lento.activo
+            and event.command_name != "explain" and coleccion != COLECCION_OPERACIONES_LENTAS
+        ):
+            self._pendientes[(event.connection_id, event.request_id)] = (event, coleccion, consultas)
+
+    def succeeded(self, event):
+        consultas = peticion_actual.get()
+        if consultas is not None:
+            consultas.duraciones.append(event.duration_micros)
+        self._terminar(event)
+
+    def failed(self, event):
+        consultas = peticion_actual.get()
+        if consultas is not None:
+            consultas.duraciones.append(event.duration_micros)
+        self._terminar(event)
+
+    def _terminar(self, event):
+        pendiente = self._pendientes.pop((event.connection_id, event.request_id), None)
+        if pendiente is None or event.duration_micros < self.registro_lento.umbral_micros:
+            return
+        inicio, coleccion, consultas = pendiente
+        operacion = {
+            "fecha": datetime.now(timezone.utc),
+            "comando": event.command_name,
+            "baseDatos": event.database_name,
+            "coleccion": coleccion,
+            "forma": forma_comando(event.command_name, inicio.command),
+            "duracionMs": event.duration_micros / 1000,
+            "ruta": None,
+        }
+        comando = comando_explicable(event.command_name, inicio.command)
+        self.registro_lento.capturar(operacion, comando, consultas.scope if consultas is not None else None)
+
+
+def encabezado_server_timing(consultas, duracion):
+    return f'mongo;dur={consultas.duracion_ms():.1f};desc="{consultas.total()} comandos", app;dur={duracion * 1000:.1f}'
+
+
+class MiddlewareConsultas:
+    # Middleware ASGI puro: cuenta los comandos a MongoDB de cada petición y los reporta en Server-Timing
+    def __init__(self, app, presupuesto=PRESUPUESTO_CONSULTAS, umbral_n_mas_1=UMBRAL_N_MAS_1):
+        self.app = app
+        self.presupuesto = presupuesto
+        self.umbral_n_mas_1 = umbral_n_mas_1
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        consultas = ConsultasPeticion(scope)
+        token = peticion_actual.set(consultas)
+        inicio = time.perf_counter()
+
+        async def enviar(mensaje):
+            if mensaje["type"] == "http.response.start":
+                # Lo consultado hasta que empieza la respuesta (en NDJSON el resto sigue en el cuerpo)
+                encabezado = encabezado_server_timing(consultas, time.perf_counter() - inicio)
+                mensaje = {**mensaje, "headers": [*mensaje.get("headers", []), (b"server-timing", encabezado.encode())]}
+            await send(mensaje)
+
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            peticion_actual.reset(token)
+            self.revisar(scope, consultas)
+
+    def revisar(self, scope, consultas):
+        peticion = f'{scope["method"]} {scope["path"]}'
+        if consultas.consultas() > self.presupuesto:
+            logger.warning(
+                "%s: %d consultas a MongoDB (presupuesto %d; %d comandos con getMore, %.1f ms)",
+                peticion, consultas.consultas(), self.presupuesto, consultas.total(), consultas.duracion_ms()
+            )
+        for (comando, coleccion), veces in consultas.repetidos(self.umbral_n_mas_1):
+            logger.warning("%s: posible N+1, %s sobre '%s' repetido %d veces", peticion, comando, coleccion, veces)
@@ -0,0 +1,57 @@
+import base64
+import json
+
+from fastapi import HTTPException
+from pymongo import ASCENDING, DESCENDING
+
+LIMITE_POR_DEFECTO = 50
+LIMITE_MAXIMO = 500
+
+def codificar_cursor(valor):
+    # Cursor opaco para el cliente: base64 del último valor de la llave de paginación
+    return base64.urlsafe_b64encode(json.dumps(valor).encode()).decode().rstrip("=")
+
+def decodificar_cursor(cursor: str):
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
+def valor_inicial(after, cursor):
+    # ?after=<id> y ?cursor=<opaco> son equivalentes; el cursor tiene prioridad
+    return decodificar_cursor(cursor) if cursor else after
+
+async def paginar(coleccion, filtro, campo, after=None, limite=LIMITE_POR_DEFECTO, orden="asc", proyeccion=None):
+    # Paginación por llave (keyset): sin skip, cada página es un rango del índice de 'campo'
+    ascendente = orden == "asc"
+    if after is not None:
+        filtro = {**filtro, campo: {"$gt" if ascendente else "$lt": after}}
+
+    # Se pide un documento de más para saber si existe una página siguiente
+    cursor = coleccion.find(filtro, proyeccion).sort(campo, ASCENDING if ascendente else DESCENDING).limit(limite + 1)
+    documentos = await cursor.to_list(length=limite + 1)
+
+    siguiente = None
+    if len(documentos) > limite:
+        documentos = documentos[:limite]
+        siguiente = codificar_cursor(documentos[-1][campo])
+    return documentos, siguiente
+
+def parsear_ids(ids: str):
+    # ?ids=1,2,3 -> [1, 2, 3] conservando el orden pedido
+    try:
+        valores = [int(valor) for valor in ids.split(",") if valor.strip()]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="ids debe ser una lista de enteros separados por comas")
+    if len(valores) > LIMITE_MAXIMO:
+        raise HTTPException(status_code=400, detail=f"No se pueden pedir más de {LIMITE_MAXIMO} ids")
+    return valores
+
+async def obtener_por_ids(coleccion, campo, ids, proyeccion=None):
+    # Una sola consulta $in; el resultado respeta el orden pedido e informa los ids faltantes
+    if not ids:
+        return [], []
+    documentos = {documento[campo]: documento async for documento in coleccion.find({campo: {"$in": ids}}, proyeccion)}
+    encontrados = [documentos[valor] for valor in ids if valor in documentos]
+    faltantes = [valor for valor in ids if valor not in documentos]
+    return encontrados, faltantes
@@ -0,0 +1,139 @@
+import asyncio
+import itertools
+import os
+import sys
+import threading
+import time
+from collections import Counter, OrderedDict
+from datetime import datetime, timezone
+
+from monitoreo import token_admin_valido
+
+# Intervalo de muestreo y cantidad de perfiles que se conservan en memoria
+INTERVALO_PERFIL_MS = float(os.environ.get("INTERVALO_PERFIL_MS", 1))
+PERFILES_GUARDADOS = int(os.environ.get("PERFILES_GUARDADOS", 20))
+
+# Pseudo-pilas para las muestras en las que la petición perfilada no está corriendo en el loop
+ESPERANDO = "(esperando E/S o al driver)"
+OTRAS_TAREAS = "(otras tareas del event loop)"
+
+
+def pila_colapsada(frame):
+    # "main.py:consultar_citas;fastapi/routing.py:serialize_response;..." de la raíz a la hoja
+    partes = []
+    while frame is not None:
+        codigo = frame.f_code
+        archivo = os.path.join(*codigo.co_filename.replace("\\", "/").split("/")[-2:])
+        partes.append(f"{archivo}:{codigo.co_qualname}")
+        frame = frame.f_back
+    return ";".join(reversed(partes))
+
+
+class Muestreador(threading.Thread):
+    # Lee la pila del hilo del event loop cada 'intervalo' segundos mientras la tarea perfilada es la que corre
+    def __init__(self, loop, tarea, intervalo):
+        super().__init__(name="perfilador", daemon=True)
+        self.loop = loop
+        self.tarea = tarea
+        self.intervalo = intervalo
+        self.id_hilo = threading.get_ident()
+        self.muestras = Counter()
+        self.detenido = threading.Event()
+
+    def run(self):
+        while not self.detenido.wait(self.intervalo):
+            actual = asyncio.current_task(self.loop)
+            if actual is not self.tarea:
+                self.muestras[ESPERANDO if actual is None else OTRAS_TAREAS] += 1
+                continue
+            frame = sys._current_frames().get(self.id_hilo)
+            if frame is not None:
+                self.muestras[pila_colapsada(frame)] += 1
+
+    def detener(self):
+        self.detenido.set()
+        self.join()
+
+
+class Perfiles:
+    # Últimos perfiles por id, en memoria del proceso
+    def __init__(self, tamano_maximo=PERFILES_GUARDADOS):
+        self.tamano_maximo = tamano_maximo
+        self.ids = itertools.count(1)
+        self.en_curso = False
+        self._datos = OrderedDict()
+
+    def guardar(self, idPerfil, perfil):
+        self._datos[idPerfil] = perfil
+        while len(self._datos) > self.tamano_maximo:
+            self._datos.popitem(last=False)
+
+    def obtener(self, idPerfil):
+        return self._datos.get(idPerfil)
+
+    def listar(self):
+        return [
+            {clave: valor for clave, valor in perfil.items() if clave != "muestras"}
+            for perfil in reversed(self._datos.values())
+        ]
+
+
+def colapsar(muestras):
+    # Formato de pilas colapsadas (flamegraph.pl, speedscope): "pila cuenta" por línea
+    return "".join(f"{pila} {cuenta}\n" for pila, cuenta in muestras.most_common())
+
+
+class MiddlewarePerfilador:
+    # Middleware ASGI puro: con X-Perfilar y un X-Token-Admin válido la petición se atiende bajo el muestreador
+    def __init__(self, app, perfiles: Perfiles, intervalo_ms=INTERVALO_PERFIL_MS):
+        self.app = app
+        self.perfiles = perfiles
+        self.intervalo = intervalo_ms / 1000
+
+    def solicitado(self, scope):
+        encabezados = dict(scope["headers"])
+        if encabezados.get(b"x-perfilar", b"").lower() not in (b"1", b"true", b"si"):
+            return False
+        token = encabezados.get(b"x-token-admin")
+        return token_admin_valido(token.decode("latin-1") if token is not None else None)
+
+    async def __call__(self, scope, receive, send):
+        # Una sola petición perfilada a la vez: el muestreador ve todo el hilo del event loop
+        if scope["type"] != "http" or self.perfiles.en_curso or not self.solicitado(scope):
+            return await self.app(scope, receive, send)
+
+        perfiles = self.perfiles
+        perfiles.en_curso = True
+        idPerfil = next(perfiles.ids)
+        estatus = 500
+
+        async def enviar(mensaje):
+            nonlocal estatus
+            if mensaje["type"] == "http.response.start":
+                estatus = mensaje["status"]
+                mensaje = {**mensaje, "headers": [*mensaje.get("headers", []), (b"x-perfil-id", str(idPerfil).encode())]}
+            await send(mensaje)
+
+        muestreador = Muestreador(asyncio.get_running_loop(), asyncio.current_task(), self.intervalo)
+        # Con el intervalo del GIL por defecto (5 ms) el muestreador no alcanzaría al código que no suelta el GIL
+        intervalo_gil = sys.getswitchinterval()
+        sys.setswitchinterval(min(intervalo_gil, self.intervalo))
+        inicio = time.perf_counter()
+        muestreador.start()
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            muestreador.detener()
+            sys.setswitchinterval(intervalo_gil)
+            perfiles.en_curso = False
+            perfiles.guardar(idPerfil, {
+                "idPerfil": idPerfil,
+                "fecha": datetime.now(timezone.utc).isoformat(),
+                "metodo": scope["method"],
+                "ruta": scope["path"],
+                "estatus": estatus,
+                "duracionMs": (time.perf_counter() - inicio) * 1000,
+                "intervaloMs": self.intervalo * 1000,
+                "totalMuestras": sum(muestreador.muestras.values()),
+                "muestras": muestreador.muestras,
+            })
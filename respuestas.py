@@ -0,0 +1,57 @@
+import orjson
+from bson import ObjectId, Decimal128
+from fastapi import Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+TIPO_NDJSON = "application/x-ndjson"
+TAMANO_LOTE_NDJSON = 500
+
+def codificar_bson(valor):
+    # Tipos BSON que orjson no conoce (datetime y date los serializa de forma nativa)
+    if isinstance(valor, ObjectId):
+        return str(valor)
+    if isinstance(valor, Decimal128):
+        return str(valor.to_decimal())
+    raise TypeError
+
+def a_json(contenido):
+    return orjson.dumps(contenido, default=codificar_bson, option=orjson.OPT_NON_STR_KEYS)
+
+class RespuestaORJSON(JSONResponse):
+    # Devolver esta respuesta directamente evita el recorrido de jsonable_encoder de FastAPI
+    def render(self, contenido) -> bytes:
+        return a_json(contenido)
+
+def etag_documento(tipo: str, id: int, version: int):
+    # ETag fuerte derivado de la versión del documento, que se incrementa en cada actualización
+    return f'"{tipo}-{id}-v{version}"'
+
+def coincide_etag(request: Request, etag: str):
+    encabezado = request.headers.get("if-none-match")
+    if not encabezado:
+        return False
+    if encabezado.strip() == "*":
+        return True
+    # If-None-Match usa comparación débil: se ignora el prefijo W/
+    return etag in (valor.strip().removeprefix("W/") for valor in encabezado.split(","))
+
+def acepta_ndjson(request: Request):
+    return TIPO_NDJSON in request.headers.get("accept", "")
+
+def respuesta_ndjson(cursor, formatear=None):
+    # Transmite el cursor de Mongo por lotes: la memoria no depende del tamaño de la colección
+    cursor = cursor.batch_size(TAMANO_LOTE_NDJSON)
+
+    async def generar():
+        lote = []
+        async for documento in cursor:
+            if formatear is not None:
+                documento = formatear(documento)
+            lote.append(a_json(documento))
+            if len(lote) >= TAMANO_LOTE_NDJSON:
+                yield b"\n".join(lote) + b"\n"
+                lote = []
+        if lote:
+            yield b"\n".join(lote) + b"\n"
+
+    return StreamingResponse(generar(), media_type=TIPO_NDJSON)
@@ -0,0 +1,66 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+# Las pruebas corren contra un mongod local, siempre en una base de datos propia que se borra al terminar;
+# se sobrescribe BD_MONGO para no tocar nunca la base de datos de un despliegue
+BD_PRUEBAS = "TelcelAPI_pruebas"
+os.environ["BD_MONGO"] = BD_PRUEBAS
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def mongo_disponible():
+    from pymongo import MongoClient
+    from pymongo.errors import PyMongoError
+
+    try:
+        MongoClient(serverSelectionTimeoutMS=500).admin.command("ping")
+        return True
+    except PyMongoError:
+        return False
+
+
+@pytest.fixture(scope="session")
+def bd():
+    for modulo in ("pymongo", "motor", "fastapi", "httpx"):
+        pytest.importorskip(modulo)
+    if not mongo_disponible():
+        pytest.skip("Se requiere un mongod local")
+
+    # La app debe apuntar a la base de datos de pruebas antes de borrar nada
+    from main import conexion_mongo
+    if conexion_mongo.bd.name != BD_PRUEBAS:
+        pytest.exit(f"La app usa la base de datos '{conexion_mongo.bd.name}', no '{BD_PRUEBAS}'", returncode=1)
+
+    from pymongo import MongoClient
+
+    cliente = MongoClient()
+    cliente.drop_database(BD_PRUEBAS)
+    yield cliente[BD_PRUEBAS]
+    cliente.drop_database(BD_PRUEBAS)
+    cliente.close()
+
+
+@pytest.fixture(scope="session")
+def ejecutar(bd):
+    # Un solo event loop para toda la sesión: el cliente de Motor y los candados quedan ligados a él
+    from main import app
+
+    loop = asyncio.new_event_loop()
+    ciclo = app.router.lifespan_context(app)
+    loop.run_until_complete(ciclo.__aenter__())
+    yield loop.run_until_complete
+    loop.run_until_complete(ciclo.__aexit__(None, None, None))
+    loop.close()
+
+
+@pytest.fixture
+def cliente_api():
+    import httpx
+    from main import app
+
+    def crear():
+        return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://pruebas")
+    return crear
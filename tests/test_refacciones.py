@@ -0,0 +1,27 @@
+import asyncio
+
+PETICIONES = 20
+
+
+def test_post_refacciones_concurrentes_misma_refaccion(bd, ejecutar, cliente_api):
+    idReparacion = 900001
+    bd.reparacion.insert_one({"idReparacion": idReparacion, "idCita": 900002, "refacciones": [], "version": 1})
+    refaccion = {
+        "idReparacion": idReparacion,
+        "idRefaccion": 7,
+        "nombre": "Pantalla",
+        "cantidad": 1,
+        "precioUnitario": 1200,
+        "descripcion": "Pantalla OLED",
+    }
+
+    async def enviar():
+        async with cliente_api() as cliente:
+            return await asyncio.gather(*(cliente.post("/refacciones", json=refaccion) for _ in range(PETICIONES)))
+
+    estatus = sorted(r.status_code for r in ejecutar(enviar()))
+    assert estatus == [200] + [400] * (PETICIONES - 1)
+
+    guardada = bd.reparacion.find_one({"idReparacion": idReparacion})
+    assert [r["idRefaccion"] for r in guardada["refacciones"]] == [7]
+    assert guardada["version"] == 2
@@ -0,0 +1,36 @@
+import asyncio
+
+PETICIONES = 50
+
+
+def reparacion(idCita):
+    return {
+        "tipoReparacion": "Cambio de Pantalla",
+        "detalles": "La pantalla se rompió",
+        "estatus": "En reparación",
+        "costoServicio": 300,
+        "total": 300,
+        "idCita": idCita,
+        "idUsuarioC": 1,
+        "idUsuarioT": 2,
+        "idDispositivo": 1,
+        "refacciones": [],
+    }
+
+
+def test_post_reparaciones_concurrentes_sin_ids_duplicados(bd, ejecutar, cliente_api):
+    idCita = 900001
+    bd.citas.insert_one({"idCita": idCita, "estatusCita": "Confirmada", "version": 1})
+
+    async def enviar():
+        async with cliente_api() as cliente:
+            return await asyncio.gather(*(
+                cliente.post("/reparaciones", json=reparacion(idCita)) for _ in range(PETICIONES)
+            ))
+
+    respuestas = ejecutar(enviar())
+    assert [r.status_code for r in respuestas] == [200] * PETICIONES
+
+    ids = sorted(r["idReparacion"] for r in bd.reparacion.find({"idCita": idCita}, {"idReparacion": 1}))
+    assert len(ids) == len(set(ids)) == PETICIONES
+    assert ids == list(range(ids[0], ids[0] + PETICIONES))